@@ -0,0 +1,89 @@
+import argparse, asyncio, hashlib, os, sys, tempfile, time
+import httpx
+# Run as a script from anywhere: the splitter lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from splitter.scraper import PaperScraper, scrape_and_split
+from synthetic import papers, make_paper
+
+index_url = "https://papers.example/past-papers/"
+
+# Local stand-in for a past paper site, served through httpx.MockTransport: an index page linking every paper,
+# with ETags (so re-runs get 304s), latency on every request, and a few misbehaving links:
+#   busy.pdf answers 503 (Retry-After: 0) twice before serving the paper, flaky.pdf drops the first connection,
+#   broken.pdf is an HTML error page served with a 200
+class StandInServer:
+    def __init__(self, files, latency=0.05):
+        self.files = files # name: PDF bytes
+        self.latency = latency
+        self.requests = {} # path: requests seen
+
+    async def handle(self, request):
+        path = request.url.path
+        self.requests[path] = self.requests.get(path, 0) + 1
+        await asyncio.sleep(self.latency)
+        if path == "/past-papers/":
+            links = "".join(f'<li><a href="{name}">{name}</a></li>' for name in [*self.files, "broken.pdf"])
+            return httpx.Response(200, html=f"<ul>{links}</ul>")
+        name = path.rsplit("/", 1)[-1]
+        if name == "busy.pdf" and self.requests[path] <= 2: return httpx.Response(503, headers={"Retry-After": "0"})
+        if name == "flaky.pdf" and self.requests[path] == 1: raise httpx.ConnectError("Connection reset", request=request)
+        if name == "broken.pdf": return httpx.Response(200, html="<h1>Not found</h1>")
+        if name not in self.files: return httpx.Response(404)
+        etag = '"' + hashlib.sha256(self.files[name]).hexdigest()[:16] + '"'
+        if request.headers.get("if-none-match") == etag: return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, content=self.files[name], headers={"ETag": etag, "Content-Type": "application/pdf"})
+
+# Lines describing what didn't go as expected, empty if everything did
+def _check(downloads, expected):
+    statuses = {os.path.basename(d.url): d.status for d in downloads}
+    return [f"{name}: {statuses.get(name, 'missing')} instead of {status}" for name, status in expected.items() if statuses.get(name) != status]
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl a local stand-in past paper site: time the downloads and check re-runs, retries and failures")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the stand-in server takes to answer each request")
+    parser.add_argument("--split", action="store_true", help="Also split the papers as they arrive (scrape_and_split)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Splitter worker processes with --split")
+    args = parser.parse_args()
+
+    problems = []
+    with tempfile.TemporaryDirectory() as workDir:
+        files = {}
+        for name in papers:
+            with open(make_paper(os.path.join(workDir, f"{name}.pdf"), **papers[name]), "rb") as f: files[f"{name}.pdf"] = f.read()
+        files["busy.pdf"], files["flaky.pdf"] = files["plain.pdf"], files["either_or.pdf"]
+        server = StandInServer(files, args.latency)
+        downloadDir, exportDir = os.path.join(workDir, "downloads"), os.path.join(workDir, "exports")
+
+        def scrape():
+            scraper = PaperScraper(downloadDir, args.concurrency, retries=3, backoff=0.01, transport=httpx.MockTransport(server.handle))
+            return asyncio.run(scraper.scrape(index_url))
+
+        def crawl(run, expected, split):
+            start = time.perf_counter()
+            if split:
+                downloads, report = scrape_and_split(index_url, downloadDir, exportDir, args.concurrency, transport=httpx.MockTransport(server.handle), workers=args.workers)
+            else: downloads, report = scrape(), None
+            seconds = time.perf_counter() - start
+            found = _check(downloads, expected)
+            if report and split == "new" and len(report.succeeded) != len(files): found.append(f"split {len(report.succeeded)} of {len(files)} papers")
+            if report and split == "same" and len(report.skipped) != len(files): found.append(f"skipped {len(report.skipped)} of {len(files)} unchanged papers")
+            problems.extend(f"{run}: {problem}" for problem in found)
+            print(f"{run:<14} {len(downloads):>3} links  {sum(d.bytes for d in downloads)/1e6:6.2f}MB  {seconds:6.2f}s  "
+                  + (f"{report.summary().splitlines()[0]}  " if report else "") + ("OK" if not found else "FAILED " + "; ".join(found)))
+
+        downloaded = {name: "downloaded" for name in files} | {"broken.pdf": "failed"}
+        crawl("first run", downloaded, args.split and "new")
+        if server.requests.get("/past-papers/busy.pdf") != 3: problems.append(f"busy.pdf: {server.requests.get('/past-papers/busy.pdf')} requests instead of 3")
+        if server.requests.get("/past-papers/flaky.pdf") != 2: problems.append(f"flaky.pdf: {server.requests.get('/past-papers/flaky.pdf')} requests instead of 2")
+        for name, data in files.items():
+            with open(os.path.join(downloadDir, name), "rb") as f:
+                if f.read() != data: problems.append(f"{name}: downloaded bytes differ")
+        # Every paper is on disk with its ETag now: the server should only answer 304s
+        crawl("re-run", {name: "unchanged" for name in files} | {"broken.pdf": "failed"}, args.split and "same")
+
+    for problem in problems: print("  " + problem)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
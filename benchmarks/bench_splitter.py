@@ -0,0 +1,106 @@
+import argparse, json, os, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+# Run as a script from anywhere: the splitter lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from splitter.splitter import SplitQuestions, image_hash, split_stages, output_formats, layouts
+from synthetic import papers, make_paper
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+golden_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden.json")
+
+# Short hash of an image, enough to tell whether a stage's output changed
+def _digest(img): return [img.width, img.height, image_hash(img)[:16]]
+
+# Runs in a fresh worker process per paper, so its peak memory is the paper's own
+# Returns the paper's stage timings, peak RSS and hashes of its slices, questions and id strips
+def _bench_one(pdfPath, exportPath, outputFormat, layout):
+    outputs = {"slices": [], "questions": [], "strips": [], "names": []}
+    # Hashed as they stream past: vector questions can only be read while the split has the source open
+    def hook(stage, item):
+        if stage == "slicing": outputs["slices"].append(_digest(item[1]))
+        if stage == "saving":
+            outputs["questions"].append(_digest(item.image))
+            outputs["strips"].append(_digest(item.id_strip))
+            outputs["names"].append(item.name)
+    start = time.perf_counter()
+    split = SplitQuestions(pdfPath, export_path=exportPath, eager=False, output_format=outputFormat, layout=layout, stage_hook=hook)
+    pages = len(split.source)
+    for _ in split.split(): pass
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    return {"seconds": seconds, "pages": pages, "stages": split.stage_seconds, "peak_mb": peak, "outputs": outputs}
+
+# Differences between a paper's outputs and its golden outputs, as readable lines
+def _compare(outputs, golden):
+    if golden is None: return ["no golden outputs (run with --update-golden)"]
+    problems = []
+    for key, expected in golden.items():
+        found = outputs.get(key, [])
+        if len(found) != len(expected): problems.append(f"{key}: {len(found)} instead of {len(expected)}")
+        else:
+            changed = [i for i, (a, b) in enumerate(zip(found, expected)) if a != b]
+            if changed: problems.append(f"{key}: {len(changed)} differ, first at #{changed[0]}")
+    return problems
+
+# Other formats have to cut papers up exactly like PNG does: same slices, same questions under the same names
+def _compare_layout(outputs, pngGolden):
+    if pngGolden is None: return []
+    problems = [f"{key}: {len(outputs[key])} instead of {len(pngGolden[key])} as PNG" for key in ("slices", "questions") if len(outputs[key]) != len(pngGolden[key])]
+    if not problems and outputs["names"] != pngGolden["names"]: problems.append("names: not the same as PNG")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Split synthetic question papers, time every stage and check the output against golden hashes")
+    parser.add_argument("papers", nargs="*", default=list(papers), help=f"Synthetic papers to split (default: all of {', '.join(papers)})")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Splits per paper; the fastest one is reported")
+    parser.add_argument("--format", choices=output_formats, default=output_formats[0], help="Question output format to benchmark")
+    # Both layouts are checked against the same golden outputs, which is how the coordinates layout is validated
+    parser.add_argument("--layout", choices=layouts, default=layouts[0], help="How gaps between question blocks are found")
+    parser.add_argument("--update-golden", action="store_true", help="Record this run's outputs as the golden ones (after an intended change)")
+    parser.add_argument("--json", help="Also write the full results to this file")
+    args = parser.parse_args()
+
+    golden = {}
+    if os.path.exists(golden_path):
+        with open(golden_path) as f: golden = json.load(f)
+    formatGolden = golden.setdefault(args.format, {})
+
+    results, failed = {}, False
+    with tempfile.TemporaryDirectory() as workDir:
+        # max_tasks_per_child=1: a new process for every split, so peak memory isn't inherited from earlier papers
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+            for name in args.papers:
+                pdfPath = make_paper(os.path.join(workDir, f"{name}.pdf"), **papers[name])
+                runs = [pool.submit(_bench_one, pdfPath, os.path.join(workDir, "exports"), args.format, args.layout).result() for _ in range(args.repeat)]
+                best = min(runs, key=lambda run: run["seconds"])
+                best["peak_mb"] = max(run["peak_mb"] or 0 for run in runs) or None
+                results[name] = best
+
+                if args.update_golden: formatGolden[name] = best["outputs"]
+                problems = _compare(best["outputs"], formatGolden.get(name))
+                if args.format != "png": problems += _compare_layout(best["outputs"], golden.get("png", {}).get(name))
+                failed = failed or bool(problems)
+                peak = f"{best['peak_mb']:.0f}MB" if best["peak_mb"] else "n/a"
+                print(f"{name:<10} {best['pages']:>3} pages {len(best['outputs']['questions']):>3} questions "
+                      f"{best['seconds']:6.2f}s  {best['pages']/best['seconds']:6.1f} pages/s  peak {peak}  "
+                      f"{'MATCH' if not problems else 'MISMATCH ' + '; '.join(problems)}")
+                print("           " + "  ".join(f"{stage} {best['stages'][stage]*1000:.0f}ms" for stage in split_stages))
+
+    totalPages = sum(result["pages"] for result in results.values())
+    totalSeconds = sum(result["seconds"] for result in results.values())
+    print(f"{totalPages} pages in {totalSeconds:.2f}s: {totalPages/totalSeconds:.1f} pages/s, "
+          f"{sum(len(r['outputs']['questions']) for r in results.values())/totalSeconds:.1f} questions/s")
+
+    if args.update_golden:
+        with open(golden_path, "w") as f: json.dump(golden, f, indent=1, sort_keys=True)
+    if args.json:
+        with open(args.json, "w") as f: json.dump(results, f, indent=1)
+    return 1 if failed and not args.update_golden else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import argparse, json, os, subprocess, sys, tempfile, time
+# Run as a script from anywhere: the splitter lives in the repository root
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+from splitter.index import QuestionIndex
+
+# Each probe runs in a fresh interpreter (so nothing is imported yet) from a folder holding a synthetic ./exports,
+# and prints {"seconds": ..., "modules": heavy modules it ended up importing} as its last line
+_heavy_modules = ("fitz", "numpy", "PIL.Image", "icecream", "splitter.splitter", "splitter.phash")
+_probe = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+{body}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+probes = {
+    # What the Builder needs to list questions
+    "index": "from splitter import QuestionIndex\nQuestionIndex('exports').count()",
+    # The GUI up to the first screen being ready to show (flet's own window start up isn't included)
+    "gui": "import flet as ft\nfrom views.gui import TabsRow, BuilderScreen, SplitterScreen\n"
+           "tabs = TabsRow(0, [BuilderScreen, SplitterScreen])\ntabs.screen(0)",
+    # The command line splitter, up to parsing its arguments
+    "cli": "sys.argv = ['main.py', '--help']\nimport runpy\ntry: runpy.run_path({main!r}, run_name='__main__')\nexcept SystemExit: pass",
+}
+
+# A question index like a big export folder's: papers x 20 questions over a few syllabuses, years and sessions
+def make_index(exportPath, papers):
+    with QuestionIndex(exportPath) as index:
+        for number in range(papers):
+            syllabus, year, session = ["0606", "4037", "9709"][number % 3], 10 + number // 30 % 12, ["M/J", "O/N", "F/M"][number // 3 % 3]
+            paper = f"{syllabus}_{year}_{number}"
+            index.replace_paper(paper, [{
+                "paper": paper, "paper_id": f"{syllabus}/{1 + number % 2}{1 + number % 3}/{session}/{year}", "number": question, "either_or": "",
+                "first_page": question // 2, "last_page": question // 2, "image_path": f"questions/{paper}_{question}.png",
+                "id_strip_path": f"question_ids/{paper}_{question}.png", "thumbnail_path": f"thumbnails/{paper}_{question}.png",
+                "width": 2480, "height": 800, "content_hash": f"{number}{question}", "phash": None,
+            } for question in range(1, 21)])
+
+def _run(name, workDir):
+    script = _probe.format(root=root, heavy=_heavy_modules, body=probes[name].format(main=os.path.join(root, "main.py")))
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script], cwd=workDir, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_seconds"] = time.perf_counter() - start
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Time how long the GUI and the command line take to start, each in a fresh interpreter")
+    parser.add_argument("probes", nargs="*", default=list(probes), help=f"What to start (default: all of {', '.join(probes)})")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Starts per probe; the fastest one is reported")
+    parser.add_argument("--papers", type=int, default=500, help="Papers in the synthetic question index (20 questions each)")
+    parser.add_argument("--json", help="Also write the full results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workDir:
+        make_index(os.path.join(workDir, "exports"), args.papers)
+        for name in args.probes:
+            # The first GUI start has no snapshot of the index yet (see BuilderScreen._open), later ones do
+            if name == "gui": results["gui (no snapshot)"] = _run(name, workDir)
+            runs = [_run(name, workDir) for _ in range(args.repeat)]
+            results[name] = min(runs, key=lambda run: run["seconds"])
+    for name, result in results.items():
+        print(f"{name:<18} {result['seconds']*1000:7.0f}ms in Python  {result['process_seconds']*1000:7.0f}ms with interpreter start  "
+              f"imports {', '.join(result['modules']) or 'nothing heavy'}")
+
+    if args.json:
+        with open(args.json, "w") as f: json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    sys.exit(main())
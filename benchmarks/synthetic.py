@@ -0,0 +1,146 @@
+import fitz, random
+
+# Synthetic Cambridge style question papers, laid out the way the splitter expects real ones:
+# page number first on every page, "© UCLES ... <paper id>" footer, Examiner's Use column, bold question numbers
+# in the left margin, dotted answer lines, BLANK PAGEs, Section headings, EITHER/OR alternatives and an Additional page
+
+a4 = fitz.paper_rect("a4")
+body_font, bold_font = "helv", "hebo"
+font_size = 11
+line_height = 16
+
+vocabulary = ["find", "the", "value", "of", "show", "that", "given", "curve", "equation", "hence", "solve", "point",
+              "line", "gradient", "area", "region", "between", "function", "where", "constant", "integer", "exact",
+              "form", "coordinates", "tangent", "normal", "matrix", "vector", "angle", "radians", "series"]
+
+# Papers the benchmark splits, by name: keyword arguments for make_paper
+papers = {
+    "either_or": dict(seed=1),
+    "sections": dict(paper_id="4037/22/M/J/13", questions=12, either_or=False, section=True, seed=2),
+    "plain": dict(questions=8, blank=False, additional=False, seed=3),
+    "long": dict(paper_id="0606/11/O/N/14", questions=14, section=True, seed=4),
+    "big": dict(paper_id="0606/21/M/J/15", questions=45, section=True, seed=5),
+}
+
+class PaperWriter:
+    def __init__(self, paper_id, seed=0):
+        self.doc = fitz.open()
+        self.paper_id = paper_id
+        self.rng = random.Random(seed)
+        self.page = None
+        self.y = 0
+        self._cover()
+
+    def _words(self, count): return " ".join(self.rng.choice(vocabulary) for _ in range(count))
+
+    def _cover(self):
+        page = self.doc.new_page(width=a4.width, height=a4.height)
+        page.insert_text((60, 80), "Cambridge International Examinations", fontname=bold_font, fontsize=14)
+        page.insert_text((60, 110), "ADDITIONAL MATHEMATICS", fontname=bold_font, fontsize=12)
+        page.insert_text((60, 140), "READ THESE INSTRUCTIONS FIRST", fontname=bold_font, fontsize=10)
+        page.insert_text((60, 810), self.paper_id, fontname=body_font, fontsize=9)
+
+    def new_page(self, examiner_column=True):
+        page = self.doc.new_page(width=a4.width, height=a4.height)
+        page.insert_text((a4.width/2 - 3, 40), str(len(self.doc)), fontname=body_font, fontsize=font_size)
+        page.insert_text((60, 815), f"© UCLES 2012   {self.paper_id}", fontname=body_font, fontsize=9)
+        page.insert_text((a4.width - 100, 815), "[Turn over", fontname=bold_font, fontsize=9)
+        if examiner_column:
+            page.insert_text((545, 80), "For", fontname=body_font, fontsize=8)
+            page.insert_text((535, 90), "Examiner's", fontname=body_font, fontsize=8)
+            page.insert_text((545, 100), "Use", fontname=body_font, fontsize=8)
+            page.draw_line((530, 60), (530, 780), width=0.5)
+        self.page, self.y = page, 75
+        return page
+
+    # Start a new page unless height points still fit on this one
+    def _ensure(self, height):
+        if self.page is None or self.y + height > 770: self.new_page()
+
+    def text(self, x, lines, fontname=body_font):
+        self._ensure(line_height * len(lines))
+        for line in lines:
+            self.y += line_height
+            self.page.insert_text((x, self.y), line, fontname=fontname, fontsize=font_size)
+
+    def gap(self, points=30): self.y += points
+
+    # A numbered question with a few lines of text, then parts (a), (b)... with marks, diagrams and answer lines
+    def question(self, number, parts, label=None):
+        lines = [self._words(self.rng.randint(6, 10)) for _ in range(self.rng.randint(1, 3))]
+        self._ensure(line_height * (len(lines) + 2))
+        self.page.insert_text((50, self.y + line_height), str(number), fontname=bold_font, fontsize=font_size)
+        if label:
+            self.page.insert_text((80, self.y + line_height), label, fontname=bold_font, fontsize=font_size)
+            self.y += line_height
+        self.text(80, lines)
+        for part in range(parts):
+            self.gap(self.rng.choice([24, 30, 40]))
+            self._ensure(line_height * 4)
+            self.page.insert_text((80, self.y + line_height), f"({'abcdefg'[part]})", fontname=body_font, fontsize=font_size)
+            self.text(105, [self._words(self.rng.randint(5, 9))])
+            self.page.insert_text((500, self.y), f"[{self.rng.randint(1, 5)}]", fontname=body_font, fontsize=font_size)
+            if self.rng.random() < 0.3:
+                self.gap(24)
+                self._ensure(110)
+                self.page.draw_rect(fitz.Rect(150, self.y, 350, self.y + 90), width=1)
+                self.page.draw_circle((250, self.y + 45), 30, width=1)
+                self.y += 90
+            for _ in range(self.rng.randint(1, 3)):
+                self.gap(24)
+                self._ensure(line_height)
+                self.y += line_height
+                self.page.insert_text((80, self.y), "." * 110, fontname=body_font, fontsize=font_size)
+        self.gap(40)
+
+    # The EITHER alternative at the foot of a page, the OR alternative on the next one
+    def either_or(self, number):
+        self._ensure(400)
+        self.question(number, 2, label="EITHER")
+        self.new_page()
+        self.page.insert_text((80, self.y + line_height), "OR", fontname=bold_font, fontsize=font_size)
+        self.y += line_height
+        self.text(80, [self._words(8)])
+        for part in range(2):
+            self.gap(30)
+            self.page.insert_text((80, self.y + line_height), f"({'ab'[part]})", fontname=body_font, fontsize=font_size)
+            self.text(105, [self._words(7)])
+
+    def section(self, name):
+        self._ensure(line_height * 6)
+        self.page.insert_text((a4.width/2 - 25, self.y + line_height), f"Section {name}", fontname=bold_font, fontsize=font_size)
+        self.y += line_height
+        self.gap(40)
+
+    def blank_page(self):
+        page = self.doc.new_page(width=a4.width, height=a4.height)
+        page.insert_text((a4.width/2 - 3, 40), str(len(self.doc)), fontname=body_font, fontsize=font_size)
+        page.insert_text((a4.width/2 - 35, 420), "BLANK PAGE", fontname=bold_font, fontsize=font_size)
+        page.insert_text((60, 815), f"© UCLES 2012   {self.paper_id}", fontname=body_font, fontsize=9)
+        self.page = None
+
+    def additional_page(self):
+        self.new_page()
+        self.page.insert_text((80, self.y + line_height), "Additional page", fontname=bold_font, fontsize=font_size)
+        self.y += line_height * 2
+        for _ in range(10):
+            self.y += 24
+            self.page.insert_text((80, self.y), "." * 110, fontname=body_font, fontsize=font_size)
+
+    def permission(self):
+        self.page.insert_text((60, 760), "Permission to reproduce items where third-party owned material protected by copyright is included",
+                              fontname=body_font, fontsize=7)
+
+# Write a synthetic paper to path; the same arguments always give the same PDF
+def make_paper(path, paper_id="4037/12/O/N/12", questions=10, either_or=True, blank=True, additional=True, section=False, seed=0):
+    writer = PaperWriter(paper_id, seed)
+    writer.new_page()
+    for number in range(1, questions + 1):
+        if section and number == questions // 2 + 1: writer.section("B")
+        writer.question(number, writer.rng.randint(0, 3))
+        if blank and number == questions // 2: writer.blank_page()
+    if either_or: writer.either_or(questions + 1)
+    if additional: writer.additional_page()
+    writer.permission()
+    writer.doc.save(path)
+    return path
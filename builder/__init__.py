@@ -0,0 +1 @@
+from .builder import build_paper
@@ -0,0 +1,92 @@
+import fitz, os, struct
+
+a4 = fitz.paper_rect("a4")
+
+# PNG colour types that map straight onto a PDF colour space (no alpha), and how many colour components they carry
+_png_colours = {0: ("/DeviceGray", 1), 2: ("/DeviceRGB", 3), 3: (None, 1)}
+
+# Embed a PNG as an image XObject by copying its zlib compressed IDAT data as is:
+# PNG rows are Flate streams with PNG predictors, which PDF readers decode natively, so nothing gets re-encoded
+# Returns (xref, width, height), or None for PNGs that need decoding first (interlaced, alpha, transparency)
+def _embed_png(doc, path):
+    with open(path, "rb") as f: data = f.read()
+    if data[:8] != b"\x89PNG\r\n\x1a\n": return None
+    pos, idat, palette, header = 8, [], None, None
+    while pos < len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos+8])
+        chunk = data[pos+8:pos+8+length]
+        pos += 12 + length
+        if kind == b"IHDR": header = struct.unpack(">IIBBBBB", chunk)
+        elif kind == b"PLTE": palette = chunk
+        elif kind == b"IDAT": idat.append(chunk)
+        elif kind == b"tRNS": return None
+        elif kind == b"IEND": break
+    width, height, depth, colour, _, _, interlace = header
+    if colour not in _png_colours or interlace: return None
+    colourSpace, colours = _png_colours[colour]
+    if colour == 3: colourSpace = f"[/Indexed /DeviceRGB {len(palette)//3-1} <{palette.hex()}>]"
+
+    xref = doc.get_new_xref()
+    doc.update_object(xref, "<<>>")
+    doc.update_stream(xref, b"".join(idat), compress=False)
+    for key, value in {"Type": "/XObject", "Subtype": "/Image", "Width": str(width), "Height": str(height),
+                       "ColorSpace": colourSpace, "BitsPerComponent": str(depth), "Filter": "/FlateDecode",
+                       "DecodeParms": f"<</Predictor 15 /Colors {colours} /BitsPerComponent {depth} /Columns {width}>>"}.items():
+        doc.xref_set_key(xref, key, value)
+    return xref, width, height
+
+# (source, width, height) of a question or id strip, with its size in image pixels at dpi
+# Vector PDF questions (see SplitQuestions output_format) come back as their open document, to be shown rather than inserted
+def _load_part(doc, path, dpi):
+    if path.lower().endswith(".pdf"):
+        part = fitz.open(path)
+        return part, part[0].rect.width*dpi/72, part[0].rect.height*dpi/72
+    return _embed_png(doc, path) or (None,) + fitz.Pixmap(path).irect[2:]
+
+# Rebuild a question paper from split question images or vector PDFs
+# questions: (question path, id strip path or None) pairs, in the order they should appear
+# Each question goes below its id strip at its original print size (images are 300dpi), starting a new page
+# whenever it doesn't fit in what's left of the current one; questions taller than a page are scaled down to fit
+# on_progress(done, total) is called after every question is placed
+def build_paper(questions, output_path, on_progress=None, page_rect=a4, margin=36, spacing=12, dpi=300):
+    doc = fitz.open()
+    images = {} # path -> (xref or document, width, height), so an image used twice is only stored once
+    try:
+        page, top = None, 0
+        usableWidth, usableHeight = page_rect.width, page_rect.height - 2*margin
+
+        for done, (imagePath, stripPath) in enumerate(questions, 1):
+            parts = []
+            for path in filter(None, (stripPath, imagePath)):
+                if path not in images:
+                    images[path] = _load_part(doc, path, dpi)
+                xref, width, height = images[path]
+                scale = min(72/dpi, usableWidth/width)
+                parts.append([path, width*scale, height*scale])
+
+            blockHeight = sum(height for _, _, height in parts)
+            if blockHeight > usableHeight: # Shrink long questions to a page
+                for part in parts:
+                    part[1:] = [part[1]*usableHeight/blockHeight, part[2]*usableHeight/blockHeight]
+                blockHeight = usableHeight
+            if page is None or top + blockHeight > page_rect.height - margin:
+                page, top = doc.new_page(width=page_rect.width, height=page_rect.height), margin
+
+            for path, width, height in parts:
+                rect = fitz.Rect(0, top, width, top+height)
+                xref = images[path][0]
+                if isinstance(xref, fitz.Document): page.show_pdf_page(rect, xref, 0) # Stored once per document, like xrefs
+                elif xref: page.insert_image(rect, xref=xref)
+                else: images[path] = (page.insert_image(rect, filename=path),) + images[path][1:]
+                top += height
+            top += spacing
+            if on_progress: on_progress(done, len(questions))
+
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        doc.save(output_path, garbage=1)
+        return len(doc)
+    finally:
+        # The vector questions' documents stay open until the paper is saved, which copies their pages
+        for part in images.values():
+            if isinstance(part[0], fitz.Document): part[0].close()
+        doc.close()
@@ -1,8 +1,26 @@
-from splitter import SplitQuestions
+import argparse
+from splitter.options import output_formats, png_colours, dedupe_modes
 
 source_path = "source_files/4037_w12_qp_12.pdf"
 
 
 if __name__ == "__main__":
-    joe = SplitQuestions()
-    pass
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Split question papers into individual question images")
+    parser.add_argument("sources", nargs="*", default=[source_path], help="PDF files, directories of PDFs or glob patterns (e.g. 'source_files/4037_w12_*.pdf')")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes (defaults to the CPU count)")
+    parser.add_argument("-o", "--exports", default="exports", help="Folder the split questions are saved to")
+    parser.add_argument("-f", "--force", action="store_true", help="Re-split every paper, even ones the export manifest says are unchanged")
+    parser.add_argument("--format", choices=output_formats, default=output_formats[0], help="Save questions as 300dpi PNGs or as vector PDFs cropped from the source")
+    parser.add_argument("--colours", choices=png_colours, default="L", help="PNG colours: 8-bit gray (L), 16 gray palette (P) or black and white (1)")
+    parser.add_argument("--compress-level", type=int, choices=range(10), default=6, metavar="0-9", help="PNG compression level, faster (0) to smaller (9)")
+    parser.add_argument("--dedupe", choices=dedupe_modes, default=dedupe_modes[0], help="Questions other papers already have: link them to the first copy, or also skip storing their images again (hard links)")
+    parser.add_argument("--trace", help="Record where the time goes: write spans of every stage, render and save to this file (.jsonl for JSON lines, otherwise a Chrome trace)")
+    args = parser.parse_args()
+
+    # Only now: --help and bad arguments shouldn't wait for PyMuPDF, and papers the manifest has as current are never opened
+    from splitter import split_batch
+
+    report = split_batch(args.sources, workers=args.workers, export_path=args.exports, force=args.force, output_format=args.format, trace_path=args.trace,
+                         png_colours=args.colours, compress_level=args.compress_level, dedupe=args.dedupe,
+                         on_result=lambda r: print(f"{'FAILED' if r.error else 'skip  ' if r.skipped else 'done  '} {r.source} ({r.seconds:.1f}s)"))
+    print(report.summary())
@@ -1 +1,11 @@
-from .splitter import SplitQuestions
\ No newline at end of file
+# Names are imported from their submodules on first use, so e.g. opening the question index doesn't load PyMuPDF
+_exports = {"SplitQuestions": "splitter", "split_batch": "batch", "collect_sources": "batch", "SplitManifest": "manifest", "QuestionIndex": "index"}
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name not in _exports: raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = globals()[name] = getattr(import_module(f".{_exports[name]}", __name__), name)
+    return value
+
+def __dir__(): return sorted(set(globals()) | set(_exports))
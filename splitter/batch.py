@@ -0,0 +1,222 @@
+import multiprocessing, os, time, traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from glob import glob
+from typing import NamedTuple
+from .splitter import SplitQuestions, export_path, splitter_version, output_formats
+from .manifest import SplitManifest, file_hash
+from .index import QuestionIndex
+from .trace import Tracer, null_tracer, write_trace
+
+source_dir = "source_files"
+
+class SplitResult(NamedTuple):
+    source: str
+    questions: int = 0
+    seconds: float = 0.0
+    error: str = None
+    outputs: tuple = ()
+    skipped: bool = False
+    number_mismatches: tuple = () # (expected, printed) question numbers that didn't follow on
+    records: tuple = () # Question index rows, see SplitQuestions.question_records
+    trace: tuple = () # Trace events of the split, when tracing
+
+class BatchReport:
+    def __init__(self, results, seconds, workers):
+        self.results = sorted(results, key=lambda r: r.source)
+        self.seconds = seconds
+        self.workers = workers
+        self.succeeded = [r for r in self.results if not r.error and not r.skipped]
+        self.skipped = [r for r in self.results if r.skipped]
+        self.failed = [r for r in self.results if r.error]
+
+    def summary(self):
+        lines = [f"Split {len(self.succeeded)}/{len(self.results)} papers "
+                 f"({sum(r.questions for r in self.succeeded)} questions) "
+                 f"in {self.seconds:.1f}s on {self.workers} workers, "
+                 f"{len(self.skipped)} unchanged papers skipped"]
+        for r in self.failed:
+            lines.append(f"  FAILED {r.source}: {r.error.strip().splitlines()[-1]}")
+        for r in self.succeeded:
+            if r.number_mismatches:
+                lines.append(f"  CHECK  {r.source}: question numbers out of sequence (expected, printed) {list(r.number_mismatches)}")
+        return "\n".join(lines)
+
+# Expand files, directories and glob patterns into a sorted, de-duplicated list of PDFs
+def collect_sources(patterns=(source_dir,)):
+    sources = set()
+    for pattern in [patterns] if isinstance(patterns, str) else patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.pdf")
+        sources.update(path for path in glob(pattern) if path.lower().endswith(".pdf") and os.path.isfile(path))
+    return sorted(sources)
+
+# Outcome of a finished split, ready to be sent back from a worker process
+def _split_result(filepath, split, seconds, tracer=null_tracer):
+    return SplitResult(filepath, split.question_count, seconds, outputs=tuple(split.saved_paths),
+                       number_mismatches=tuple(split.question_number_mismatches), records=tuple(split.question_records),
+                       trace=tuple(tracer.events))
+
+# Papers a pool's worker processes have started on (see BatchSplitter._pool_broke), set up by _start_worker
+_started = None
+
+def _start_worker(started):
+    global _started
+    _started = started
+
+# Runs inside a worker process: every paper opens its own fitz document,
+# and any failure is reported back instead of taking the rest of the batch down
+# options are passed on to SplitQuestions (output_format, png_colours, compress_level)
+# token tells the batch this paper was started, in case the process dies before it can report back
+def _split_one(filepath, exportPath, trace=False, token=None, **options):
+    if _started is not None and token is not None: _started.put(token)
+    start = time.perf_counter()
+    tracer = Tracer(paper=os.path.basename(filepath)) if trace else null_tracer
+    try:
+        with tracer.span("split"):
+            split = SplitQuestions(filepath, export_path=exportPath, tracer=tracer, **options)
+        return _split_result(filepath, split, time.perf_counter()-start, tracer)
+    except Exception:
+        return SplitResult(filepath, 0, time.perf_counter()-start, traceback.format_exc(), trace=tuple(tracer.events))
+
+# Splits papers on a pool of worker processes as they are added, keeping the export manifest and question index up to date
+# Papers whose source hash and splitter version match the manifest (and that are in the question index)
+# are skipped unless force is set. Only this process writes the manifest and the index
+# on_result is called in this process as each paper finishes, from wait() or collect()
+# output_format is "png" or "pdf" (vector questions), png_colours and compress_level set how PNGs are stored (see SplitQuestions)
+# With trace_path set, every worker traces its splits and the spans of all papers are written there (see trace.write_trace)
+# dedupe says what the question index does with questions other papers already have (see index.dedupe_modes)
+class BatchSplitter:
+    def __init__(self, workers=None, export_path=export_path, on_result=None, force=False, save_every=25, output_format=output_formats[0], trace_path=None,
+                 png_colours="L", compress_level=6, dedupe="link"):
+        # Switching format or colours changes every output, so those splits are versioned apart from the default ones
+        self.options = {"output_format": output_format, "png_colours": png_colours, "compress_level": compress_level}
+        variant = [output_format] if output_format != "png" else [f"png{png_colours}"] if png_colours != "L" else []
+        self.manifest = SplitManifest(export_path, "-".join([str(splitter_version)] + variant) if variant else splitter_version)
+        self.index = QuestionIndex(export_path, dedupe)
+        self.export_path, self.on_result, self.force, self.save_every, self.trace_path = export_path, on_result, force, save_every, trace_path
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.results = []
+        self._pool = None
+        self._pending = {} # future: (source, digest, token, attempts)
+        self._tokens = 0
+        self._started = None # Queue the pool's workers put the tokens of the papers they start on, see _split_one
+        self._started_tokens = set() # Tokens read from it of papers not collected yet
+        self._done = 0
+        self._start = time.perf_counter()
+        self.report = None # The BatchReport, once closed
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc):
+        if self.report: return
+        if exc[0] is None: self.close()
+        else: # Don't start queued papers, but keep what finished so far
+            if self._pool: self._pool.shutdown(cancel_futures=True)
+            self.manifest.save()
+            self.index.close()
+
+    def _report(self, result):
+        self.results.append(result)
+        if self.on_result: self.on_result(result)
+
+    # Hash of source if it has to be split, None (after reporting it as skipped) if its outputs are current
+    # digest is source's file_hash, if the caller already has it
+    def needs_split(self, source, digest=None):
+        digest = digest or file_hash(source)
+        paper = os.path.splitext(os.path.basename(source))[0]
+        if not self.force and self.manifest.is_current(source, digest) and self.index.has_paper(paper):
+            self._report(SplitResult(source, skipped=True))
+            return None
+        return digest
+
+    # Queue source for splitting; returns its future, which has to be handed to collect() once done (or left to wait())
+    def submit(self, source, digest=None, attempts=0):
+        if self._pool is None:
+            self._started = multiprocessing.SimpleQueue()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_start_worker, initargs=(self._started,))
+        self._tokens += 1
+        future = self._pool.submit(_split_one, source, self.export_path, bool(self.trace_path), self._tokens, **self.options)
+        self._pending[future] = (source, digest or file_hash(source), self._tokens, attempts)
+        return future
+
+    # Split source unless it's unchanged; returns its future, or None if it was skipped
+    def add(self, source):
+        digest = self.needs_split(source)
+        return self.submit(source, digest) if digest else None
+
+    # Record the outcome of a finished future from submit(), and return its SplitResult
+    # None if its paper was already dealt with (or is being split again) after a worker process died, see _pool_broke
+    def collect(self, future):
+        if future not in self._pending: return None
+        self._read_started()
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            self._pool_broke()
+            return None
+        except Exception:
+            result = SplitResult(self._pending[future][0], error=traceback.format_exc())
+        source, digest, token, _ = self._pending.pop(future)
+        self._started_tokens.discard(token)
+        return self.record(result, digest)
+
+    # Read the tokens the workers sent, so the queue never fills up and blocks them
+    def _read_started(self):
+        while not self._started.empty(): self._started_tokens.add(self._started.get())
+
+    # A worker process died (e.g. killed for running out of memory, or crashed in MuPDF), which breaks the whole pool:
+    # the papers its workers were on fail, the ones they hadn't started go to a new pool
+    # A paper only gets split again once, in case it's the one killing workers before it could be marked as started
+    def _pool_broke(self):
+        self._read_started()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        for future, (source, digest, token, attempts) in list(self._pending.items()):
+            if future.done() and not future.cancelled() and future.exception() is None: continue # Finished before the pool broke
+            del self._pending[future]
+            if token in self._started_tokens or attempts:
+                self._started_tokens.discard(token)
+                self.record(SplitResult(source, error="The worker process splitting it died (killed, or crashed)"), digest)
+            else:
+                self.submit(source, digest, attempts+1)
+
+    # Store the result of a split of result.source made outside this batch's pool (e.g. by a SplitJobQueue worker)
+    def record(self, result, digest):
+        source = result.source
+        # A failed paper is marked out of date so the next run retries it
+        if not result.error:
+            self.manifest.record(source, digest, result.outputs)
+            # e.g. two questions saved to the same file: the paper fails rather than the whole batch
+            try: self.index.replace_paper(os.path.splitext(os.path.basename(source))[0], result.records)
+            except Exception: result = result._replace(error=traceback.format_exc())
+        if result.error: self.manifest.forget(source)
+        self._done += 1
+        if self._done % self.save_every == 0: self.manifest.save()
+        self._report(result)
+        return result
+
+    # Collect every paper still being split, as each one finishes
+    def wait(self):
+        while self._pending:
+            for future in as_completed(list(self._pending)): self.collect(future)
+
+    # Wait for every paper and save the manifest and index; only the first call does anything, later ones return the same report
+    def close(self):
+        if self.report: return self.report
+        self.wait()
+        if self._pool: self._pool.shutdown()
+        self.manifest.save()
+        self.index.close()
+        if self.trace_path: write_trace([event for result in self.results for event in result.trace], self.trace_path)
+        self.report = BatchReport(self.results, time.perf_counter()-self._start, self.workers)
+        return self.report
+
+# Split every paper matched by patterns across a pool of worker processes (see BatchSplitter)
+def split_batch(patterns=(source_dir,), workers=None, export_path=export_path, on_result=None, force=False, save_every=25, output_format=output_formats[0], trace_path=None,
+                png_colours="L", compress_level=6, dedupe="link"):
+    batch = BatchSplitter(workers, export_path, on_result, force, save_every, output_format, trace_path, png_colours, compress_level, dedupe)
+    pending = [(source, digest) for source in collect_sources(patterns) if (digest := batch.needs_split(source))]
+    batch.workers = max(1, min(batch.workers, len(pending) or 1))
+    for source, digest in pending: batch.submit(source, digest)
+    return batch.close()
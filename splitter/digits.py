@@ -0,0 +1,57 @@
+import os
+import numpy as np
+from PIL import Image
+from .ink import ink_bbox
+
+# Bold question number glyphs cut from Cambridge papers at 300dpi, one tightly cropped PNG per digit
+templates_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "qnums_camb")
+
+# Reads printed question numbers by matching each digit against the qnums_camb templates
+# Templates are precomputed as one normalized matrix, so a whole number is scored with a single matrix product
+class DigitReader:
+    def __init__(self, path=templates_path, min_score=0.6):
+        glyphs = [Image.open(os.path.join(path, f"{digit}.png")).convert('L') for digit in range(10)]
+        self.height = max(glyph.height for glyph in glyphs)
+        self.width = max(glyph.width for glyph in glyphs) + 4
+        self.min_score = min_score
+        self.templates = np.stack([self._vector(glyph) for glyph in glyphs])
+
+    # Scale a digit to template height, centre it on a template sized canvas, and turn it into a zero mean unit vector
+    def _vector(self, glyph):
+        width = max(1, min(self.width, round(glyph.width * self.height / glyph.height)))
+        canvas = Image.new('L', (self.width, self.height), 255)
+        canvas.paste(glyph.resize((width, self.height), Image.BILINEAR), ((self.width-width)//2, 0))
+        vector = 255 - np.asarray(canvas, dtype=np.float32).ravel()
+        vector -= vector.mean()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # Digit images of a number, left to right, split on blank columns
+    def _digits(self, image):
+        cols = np.flatnonzero(np.asarray(image).min(axis=0) < 255)
+        if not cols.size: return []
+        breaks = np.flatnonzero(np.diff(cols) > 1)
+        lefts, rights = cols[np.r_[0, breaks+1]], cols[np.r_[breaks, cols.size-1]] + 1
+        digits = []
+        for left, right in zip(lefts.tolist(), rights.tolist()):
+            digit = image.crop((left, 0, right, image.height))
+            digits.append(digit.crop(ink_bbox(digit)))
+        return digits
+
+    # (number, score) for an image holding only a question number, or (None, score) if any digit is unconvincing
+    def read(self, image):
+        digits = self._digits(image.convert('L'))
+        if not digits or len(digits) > 3: return None, 0.0
+        scores = np.stack([self._vector(digit) for digit in digits]) @ self.templates.T
+        best = scores.argmax(axis=1)
+        score = float(scores[np.arange(len(digits)), best].min())
+        if score < self.min_score: return None, score
+        return int("".join(map(str, best.tolist()))), score
+
+_reader = None
+
+# Shared reader, built the first time a number is read in this process
+def read_question_number(image):
+    global _reader
+    if _reader is None: _reader = DigitReader()
+    return _reader.read(image)
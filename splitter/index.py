@@ -0,0 +1,234 @@
+import json, os, sqlite3, threading, uuid
+from re import compile
+from .options import dedupe_modes
+
+index_name = "questions.db"
+
+# Printed paper ids look like 4037/12/O/N/12: syllabus / paper & variant / session / year
+paper_id_parts = compile(r'(\d{4})/(\d)(\d)/([A-Z]/[A-Z])/(\d{2})')
+sessions = {"F/M": "Feb/March", "M/J": "May/June", "O/N": "Oct/Nov"}
+
+schema = """
+CREATE TABLE IF NOT EXISTS questions (
+    id              INTEGER PRIMARY KEY,
+    paper           TEXT NOT NULL,     -- Source file name, e.g. 4037_w12_qp_12
+    paper_id        TEXT,              -- As printed, e.g. 4037/12/O/N/12
+    curriculum      TEXT,
+    syllabus        TEXT,              -- e.g. 4037
+    year            INTEGER,           -- e.g. 2012
+    session         TEXT,              -- F/M, M/J or O/N
+    paper_number    INTEGER,           -- e.g. 1
+    variant         INTEGER,           -- e.g. 2
+    topic           TEXT,
+    number          INTEGER NOT NULL,  -- Question number as printed
+    either_or       TEXT NOT NULL,     -- '', 'E' or 'O'
+    first_page      INTEGER,           -- PDF page index the question starts on
+    last_page       INTEGER,
+    image_path      TEXT NOT NULL UNIQUE, -- Relative to the export folder
+    id_strip_path   TEXT,
+    thumbnail_path  TEXT,              -- Small copy for the Builder grid, shared by questions with the same content
+    width           INTEGER,
+    height          INTEGER,
+    content_hash    TEXT,
+    phash           TEXT,              -- Perceptual hash (hex, see phash.py) for finding the same question in other papers
+    duplicate_of    INTEGER            -- id of the first indexed copy of this question, NULL for first copies
+);
+-- Builder dropdowns narrow left to right: Curriculum, Subject, Year, Session & Variant, then Topic
+CREATE INDEX IF NOT EXISTS questions_filters ON questions (curriculum, syllabus, year, session, variant, number);
+CREATE INDEX IF NOT EXISTS questions_topic ON questions (topic, syllabus);
+CREATE INDEX IF NOT EXISTS questions_paper ON questions (paper);
+CREATE INDEX IF NOT EXISTS questions_content_hash ON questions (content_hash);
+-- Facts about the index itself, e.g. its id: random, set when the database is created
+CREATE TABLE IF NOT EXISTS index_info (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Columns added after the first release, created on indexes that predate them
+added_columns = {"thumbnail_path": "TEXT", "phash": "TEXT", "duplicate_of": "INTEGER"}
+
+# Copies of a question come out the same size give or take a few pixels; different questions that hash close rarely do
+_size_tolerance = 0.05
+
+# Columns the Builder may filter on or list distinct values of
+filter_columns = ("curriculum", "syllabus", "year", "session", "paper_number", "variant", "topic", "paper", "either_or")
+
+def parse_paper_id(paper_id):
+    match = paper_id_parts.fullmatch(paper_id or "")
+    if not match: return {"curriculum": None, "syllabus": None, "year": None, "session": None, "paper_number": None, "variant": None}
+    syllabus, paper_number, variant, session, year = match.groups()
+    return {"curriculum": "Cambridge", "syllabus": syllabus, "year": 2000+int(year), "session": session,
+            "paper_number": int(paper_number), "variant": int(variant)}
+
+def _similar_size(a, b):
+    return all(abs(x - y) <= _size_tolerance*max(x, y) for x, y in zip(a, b))
+
+# Local SQLite index of every split question, one row per saved question image
+# Near duplicate questions (see dedupe_modes) are found with a BK-tree of the perceptual hashes, built on first use
+# One index can be shared between threads (flet runs event handlers on a thread pool): every call holds self.lock
+class QuestionIndex:
+    def __init__(self, export_path="exports", dedupe="link"):
+        if dedupe not in dedupe_modes: raise ValueError(f"Unknown dedupe mode {dedupe!r}, expected one of {', '.join(dedupe_modes)}")
+        os.makedirs(export_path, exist_ok=True)
+        self.export_path = export_path
+        self.dedupe = dedupe
+        self._tree = None
+        self._hashed = {} # id: [paper, (width, height), first copy id, image_path] of rows in the tree
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(os.path.join(export_path, index_name), check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(schema)
+        existing = {row["name"] for row in self.connection.execute("PRAGMA table_info(questions)")}
+        for column, kind in added_columns.items():
+            if column not in existing: self.connection.execute(f"ALTER TABLE questions ADD COLUMN {column} {kind}")
+        # Created here rather than in the schema: older indexes only get the column just above
+        self.connection.execute("CREATE INDEX IF NOT EXISTS questions_duplicate_of ON questions (duplicate_of)")
+        # Tells this database apart from one rebuilt in its place, whose generations start again from 0
+        row = self.connection.execute("SELECT value FROM index_info WHERE key = 'id'").fetchone()
+        if row is None:
+            with self.connection: self.connection.execute("INSERT OR IGNORE INTO index_info VALUES ('id', ?)", (uuid.uuid4().hex,))
+            row = self.connection.execute("SELECT value FROM index_info WHERE key = 'id'").fetchone()
+        self.id = row[0]
+
+    def __enter__(self): return self
+    def __exit__(self, *_): self.close()
+    def close(self):
+        with self.lock: self.connection.close()
+
+    # Goes up with every change to the questions (kept in SQLite's user_version, which is free for applications to use)
+    @property
+    def generation(self):
+        with self.lock: return self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def _changed(self): self.connection.execute(f"PRAGMA user_version = {self.generation + 1}")
+
+    # Query results worth keeping between runs (e.g. what the Builder shows when it opens), saved next to the index
+    # snapshot(name) gives data back as long as this same index is still at generation, so nothing has to be queried again
+    def save_snapshot(self, name, generation, data):
+        path = os.path.join(self.export_path, f"{name}_snapshot.json")
+        with open(path + ".tmp", "w") as f: json.dump({"index": self.id, "generation": generation, "data": data}, f)
+        os.replace(path + ".tmp", path)
+
+    def snapshot(self, name):
+        path = os.path.join(self.export_path, f"{name}_snapshot.json")
+        try:
+            with open(path) as f: snapshot = json.load(f)
+        except (OSError, ValueError): return None
+        current = snapshot.get("index") == self.id and snapshot.get("generation") == self.generation
+        return snapshot["data"] if current else None
+
+    # Replace every row of a paper with the records of its latest split (see SplitQuestions.question_records)
+    # Questions already indexed from other papers are linked to their first copy (and with dedupe="skip" share its file)
+    def replace_paper(self, paper, records):
+        rows = [{**record, **parse_paper_id(record["paper_id"]), "topic": record.get("topic"), "duplicate_of": None} for record in records]
+        with self.lock:
+            try:
+                with self.connection:
+                    self._delete_paper(paper)
+                    for row in rows:
+                        copy = self._first_copy(row)
+                        if copy is None: continue
+                        row["duplicate_of"], copyPath = copy
+                        if self.dedupe == "skip": self._share_file(row["image_path"], copyPath)
+                    if rows:
+                        columns = list(rows[0])
+                        self.connection.executemany(f"INSERT INTO questions ({', '.join(columns)}) VALUES ({', '.join(':'+column for column in columns)})", rows)
+                    self._changed()
+            except Exception:
+                # The rows were rolled back, so the hash tree no longer matches them: it's rebuilt on the next lookup
+                self._tree, self._hashed = None, {}
+                raise
+            if self._tree is not None:
+                for row in self.connection.execute("SELECT id, paper, width, height, duplicate_of, image_path, phash FROM questions WHERE paper = ? AND phash IS NOT NULL", (paper,)):
+                    self._add_to_tree(row)
+
+    def remove_paper(self, paper):
+        with self.lock, self.connection:
+            self._delete_paper(paper)
+            self._changed()
+
+    # Delete a paper's rows; the copies of any question first indexed from it are linked to the earliest remaining copy instead
+    def _delete_paper(self, paper):
+        ids = [row[0] for row in self.connection.execute("SELECT id FROM questions WHERE paper = ?", (paper,))]
+        self.connection.execute("DELETE FROM questions WHERE paper = ?", (paper,))
+        for id in ids:
+            self._hashed.pop(id, None)
+            copies = [row[0] for row in self.connection.execute("SELECT id FROM questions WHERE duplicate_of = ? ORDER BY id", (id,))]
+            if not copies: continue
+            self.connection.execute("UPDATE questions SET duplicate_of = NULL WHERE id = ?", (copies[0],))
+            self.connection.execute("UPDATE questions SET duplicate_of = ? WHERE duplicate_of = ?", (copies[0], id))
+            for copy in copies:
+                if copy in self._hashed: self._hashed[copy][2] = copies[0] if copy != copies[0] else None
+
+    def _add_to_tree(self, row):
+        self._hashed[row["id"]] = [row["paper"], (row["width"], row["height"]), row["duplicate_of"], row["image_path"]]
+        self._tree.add(int(row["phash"], 16), row["id"])
+
+    # (id, image_path) of the first copy of the question in row, if another paper already has it
+    def _first_copy(self, row):
+        if not row.get("phash"): return None
+        # Only ingesting needs the hashing module (and the numpy and PIL it brings), not the Builder
+        from .phash import BKTree, duplicate_distance
+        if self._tree is None:
+            self._tree = BKTree()
+            for indexed in self.connection.execute("SELECT id, paper, width, height, duplicate_of, image_path, phash FROM questions WHERE phash IS NOT NULL"):
+                self._add_to_tree(indexed)
+        for _, id in self._tree.search(int(row["phash"], 16), duplicate_distance):
+            # Rows of deleted papers stay in the tree, but not in _hashed
+            if id not in self._hashed: continue
+            paper, size, firstId, imagePath = self._hashed[id]
+            if paper == row["paper"] or not _similar_size(size, (row["width"], row["height"])): continue
+            if firstId is not None: imagePath = self.connection.execute("SELECT image_path FROM questions WHERE id = ?", (firstId,)).fetchone()[0]
+            return (firstId or id), imagePath
+        return None
+
+    # Replace a duplicate's image file with a hard link to its first copy's, when both are stored the same way
+    # Where hard links aren't supported the duplicate simply keeps its own file
+    def _share_file(self, path, copyPath):
+        path, copyPath = os.path.join(self.export_path, path), os.path.join(self.export_path, copyPath)
+        if os.path.splitext(path)[1] != os.path.splitext(copyPath)[1] or not os.path.exists(copyPath): return
+        try:
+            if os.path.exists(path) and os.path.samefile(path, copyPath): return
+            os.link(copyPath, path + ".link")
+            os.replace(path + ".link", path)
+        except OSError:
+            if os.path.exists(path + ".link"): os.remove(path + ".link")
+
+    def has_paper(self, paper):
+        with self.lock: return self.connection.execute("SELECT 1 FROM questions WHERE paper = ? LIMIT 1", (paper,)).fetchone() is not None
+
+    def _where(self, filters):
+        unknown = set(filters) - set(filter_columns)
+        if unknown: raise ValueError(f"Can't filter questions by {', '.join(sorted(unknown))}")
+        filters = {column: value for column, value in filters.items() if value is not None}
+        clause = " AND ".join(f"{column} = :{column}" for column in filters)
+        return (f" WHERE {clause}" if clause else ""), filters
+
+    # Distinct non-null values of a column (or tuples of several columns) among the questions matching filters, for a dropdown
+    def distinct(self, *columns, **filters):
+        unknown = set(columns) - set(filter_columns)
+        if unknown: raise ValueError(f"Can't list questions by {', '.join(sorted(unknown))}")
+        where, params = self._where(filters)
+        where += (" AND " if where else " WHERE ") + " AND ".join(f"{column} IS NOT NULL" for column in columns)
+        with self.lock:
+            rows = self.connection.execute(f"SELECT DISTINCT {', '.join(columns)} FROM questions{where} ORDER BY {', '.join(columns)}", params)
+            return [row[0] if len(columns) == 1 else tuple(row) for row in rows]
+
+    # Rows of the questions matching filters, in paper order
+    # With collapse_duplicates, a question found in several matching papers is listed once (its first match in paper
+    # order), and every row carries copies: how many of the matching questions are that same question
+    def find(self, limit=None, offset=0, collapse_duplicates=False, **filters):
+        where, params = self._where(filters)
+        order = "syllabus, year, session, paper_number, variant, paper, number, either_or"
+        if collapse_duplicates:
+            group = "COALESCE(duplicate_of, id)"
+            query = (f"SELECT * FROM (SELECT *, COUNT(*) OVER (PARTITION BY {group}) AS copies, "
+                     f"ROW_NUMBER() OVER (PARTITION BY {group} ORDER BY {order}) AS copy FROM questions{where}) WHERE copy = 1 ORDER BY {order}")
+        else:
+            query = f"SELECT * FROM questions{where} ORDER BY {order}"
+        if limit is not None: query += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+        with self.lock: return self.connection.execute(query, params).fetchall()
+
+    def count(self, collapse_duplicates=False, **filters):
+        where, params = self._where(filters)
+        counted = "DISTINCT COALESCE(duplicate_of, id)" if collapse_duplicates else "*"
+        with self.lock: return self.connection.execute(f"SELECT COUNT({counted}) FROM questions{where}", params).fetchone()[0]
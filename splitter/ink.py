@@ -0,0 +1,64 @@
+import numpy as np
+
+# A pixel carries ink when it isn't pure white (i.e. it survives ImageOps.invert(...).getbbox())
+def _lightest(pixels):
+    # Collapse colour bands so a pixel counts as ink if any band isn't white
+    return pixels.min(axis=2) if pixels.ndim == 3 else pixels
+
+def _bbox(rows, cols):
+    rows, cols = np.flatnonzero(rows), np.flatnonzero(cols)
+    if not rows.size: return None
+    return (int(cols[0]), int(rows[0]), int(cols[-1])+1, int(rows[-1])+1)
+
+# Vectorized ImageOps.invert(image.crop(box)).getbbox()
+# Cropping goes through PIL so out of bounds boxes are padded exactly like before
+def ink_bbox(image, box=None):
+    pixels = _lightest(np.asarray(image.crop(box) if box else image))
+    ink = pixels < 255
+    return _bbox(ink.any(axis=1), ink.any(axis=0))
+
+# Per-row "has ink" projections of a page image, computed once and reused by every query
+# candidate_rows, if known, are (top, bottom) ranges holding all of the image's ink (see vector.ink_row_ranges):
+# row projections then only read those rows instead of converting the whole page
+class InkProfile:
+    def __init__(self, image, candidate_rows=None):
+        self.image = image
+        self.width, self.height = image.width, image.height
+        self.candidate_rows = candidate_rows
+        self._pixels = None
+        self._rows = {}
+
+    @property
+    def pixels(self):
+        if self._pixels is None: self._pixels = _lightest(np.asarray(self.image))
+        return self._pixels
+
+    # Rows with ink between columns left and right
+    def rows(self, left=0, right=None):
+        key = (left, right)
+        if key not in self._rows:
+            if self.candidate_rows is None or self._pixels is not None:
+                self._rows[key] = self.pixels[:, left:right].min(axis=1) < 255
+            else:
+                # Cropped through PIL, so clamp the box to the image like numpy slicing would
+                right = self.width if right is None else min(right, self.width)
+                rows = np.zeros(self.height, bool)
+                for top, bottom in self.candidate_rows:
+                    if left < right: rows[top:bottom] = _lightest(np.asarray(self.image.crop((left, top, right, bottom)))).min(axis=1) < 255
+                self._rows[key] = rows
+        return self._rows[key]
+
+    # (top, bottom) of every band of ink separated from the next by at least checkHeight blank rows
+    # Reproduces the old window-by-window scan: the first band starts at 0 when ink shows up in the first window,
+    # bands shorter than minHeight are dropped unless they run into the bottom edge of the page
+    def bands(self, checkHeight, minHeight, right=None):
+        rows = self.rows(0, right)
+        inkRows = np.flatnonzero(rows)
+        if not inkRows.size: return []
+        breaks = np.flatnonzero(np.diff(inkRows) > checkHeight)
+        tops = inkRows[np.r_[0, breaks+1]]
+        bottoms = inkRows[np.r_[breaks, inkRows.size-1]] + 1
+        if tops[0] < checkHeight: tops[0] = 0
+        keep = bottoms - tops >= minHeight
+        keep[-1] |= bottoms[-1] == rows.size
+        return list(zip(tops[keep].tolist(), bottoms[keep].tolist()))
@@ -0,0 +1,223 @@
+import itertools, multiprocessing, os, queue, threading, time, traceback
+from .batch import BatchSplitter, SplitResult, _split_result
+from .splitter import SplitQuestions, export_path
+
+# Background split jobs for the GUI: papers queue up and are split in long lived worker processes, which stream
+# events back while they work, so the screen can show each job's progress and every question as soon as it's saved
+#
+# Events, passed to on_event(job, kind, data) on the queue's dispatcher thread (update the UI from there):
+#   "queued"     the job was added
+#   "skipped"    its outputs are current (see SplitManifest), nothing to do
+#   "started"    a worker picked it up: data = {"pages": pages to slice}
+#   "progress"   data = {"stage": a split stage, "done": items it produced so far, "pages": pages taped so far}
+#   "question"   a question is on disk: data = its question index record (image_path, thumbnail_path...)
+#   "done"       data = its SplitResult; the manifest and question index are up to date
+#   "failed"     data = SplitResult with the error
+#   "cancelled"  stopped by cancel()
+
+# Seconds between progress events of a job (questions are always sent straight away)
+progress_interval = 0.1
+# Seconds a cancelled job gets to stop by itself before its worker is killed (and replaced)
+cancel_grace = 5.0
+
+class JobCancelled(Exception): pass
+
+# status: "queued", "running", "done", "failed", "cancelled" or "skipped"
+class SplitJob:
+    def __init__(self, id, source):
+        self.id = id
+        self.source = source
+        self.status = "queued"
+        self.stage = None
+        self.pages = None
+        self.pages_done = 0
+        self.questions = [] # Records of the questions saved so far
+        self.result = None # SplitResult once done or failed
+
+    @property
+    def name(self): return os.path.splitext(os.path.basename(self.source))[0]
+
+    # Fraction of the paper's pages sliced so far, 1 once finished
+    @property
+    def progress(self):
+        if self.status in ("done", "skipped"): return 1.0
+        return self.pages_done / self.pages if self.pages else 0.0
+
+# Runs in a worker process: splits every job it's handed until it gets None
+# cancel holds the id of a job to stop, checked between the items of every stage
+def _work(tasks, events, cancel, options):
+    while True:
+        task = tasks.get()
+        if task is None: return
+        jobId, filepath, exportPath = task
+        start, counts, lastSent = time.perf_counter(), {}, 0.0
+
+        def hook(stage, item):
+            nonlocal lastSent
+            if cancel.value == jobId: raise JobCancelled()
+            counts[stage] = counts.get(stage, 0) + 1
+            if stage == "saving": events.put((jobId, "question", split.question_records[-1]))
+            elif time.perf_counter() - lastSent >= progress_interval:
+                lastSent = time.perf_counter()
+                events.put((jobId, "progress", {"stage": stage, "done": counts[stage], "pages": counts.get("taping", 0)}))
+
+        try:
+            # Written on this thread, so every question is on disk by the time its event goes out
+            split = SplitQuestions(filepath, export_path=exportPath, eager=False, stage_hook=hook, write_threads=0, **options)
+            if cancel.value == jobId: raise JobCancelled()
+            events.put((jobId, "started", {"pages": len(split.white_pasties)}))
+            for _ in split.split(): pass
+            events.put((jobId, "done", _split_result(filepath, split, time.perf_counter()-start)))
+        except JobCancelled:
+            events.put((jobId, "cancelled", None))
+        except Exception:
+            events.put((jobId, "failed", SplitResult(filepath, 0, time.perf_counter()-start, traceback.format_exc())))
+
+# Parent side of a worker process
+class _Worker:
+    def __init__(self, context, events, options):
+        self.tasks = context.Queue()
+        self.cancel = context.Value("q", -1, lock=False)
+        self.process = context.Process(target=_work, args=(self.tasks, events, self.cancel, options), daemon=True)
+        self.process.start()
+        self.job = None
+        self.kill_at = None # When a cancelled job's time is up
+
+    # Killing a worker while it puts an event can leave the events queue unusable, hence the grace period
+    def stop(self, wait=True):
+        if self.process.is_alive(): self.tasks.put(None)
+        if wait: self.process.join(cancel_grace)
+        if self.process.is_alive(): self.process.kill()
+
+# Queue of split jobs run on `workers` worker processes (spawned, so they don't inherit the GUI's threads)
+# submit() and cancel() can be called from any thread; everything else happens on the dispatcher thread,
+# which also owns the export manifest and question index (see BatchSplitter) and calls on_event
+# output_format, png_colours, compress_level and dedupe are as for split_batch
+class SplitJobQueue:
+    def __init__(self, workers=None, export_path=export_path, on_event=None, force=False, output_format="png", png_colours="L", compress_level=6, dedupe="link"):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.export_path, self.on_event, self.force, self.dedupe = export_path, on_event, force, dedupe
+        self.options = {"output_format": output_format, "png_colours": png_colours, "compress_level": compress_level}
+        self.jobs = {} # id: SplitJob, in the order they were submitted
+        self._ids = itertools.count(1)
+        self._commands = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._dispatch, name="SplitJobQueue", daemon=True)
+        self._thread.start()
+
+    def __enter__(self): return self
+    def __exit__(self, *_): self.close()
+
+    def submit(self, source):
+        job = SplitJob(next(self._ids), source)
+        self.jobs[job.id] = job
+        self._commands.put(("submit", job))
+        return job
+
+    def cancel(self, job_id): self._commands.put(("cancel", job_id))
+
+    def cancel_all(self):
+        for job_id in list(self.jobs): self.cancel(job_id)
+
+    # Cancel whatever is left, stop the workers and wait for the dispatcher to finish
+    def close(self):
+        if self._closed: return
+        self._closed = True
+        self._commands.put(("close", None))
+        self._thread.join()
+
+    def _emit(self, job, kind, data=None):
+        if self.on_event:
+            try: self.on_event(job, kind, data)
+            except Exception: traceback.print_exc() # A broken screen mustn't stop the queue
+
+    def _dispatch(self):
+        context = multiprocessing.get_context("spawn")
+        events = context.Queue()
+        batch = BatchSplitter(self.workers, self.export_path, force=self.force, dedupe=self.dedupe, **self.options)
+        workers, waiting, digests, closing = [], [], {}, False
+        try:
+            while not (closing and not any(worker.job for worker in workers)):
+                # Commands from other threads
+                while True:
+                    try: command, arg = self._commands.get_nowait()
+                    except queue.Empty: break
+                    if command == "submit":
+                        self._emit(arg, "queued")
+                        if not os.path.isfile(arg.source):
+                            arg.status, arg.result = "failed", SplitResult(arg.source, error=f"No such file: {arg.source}")
+                            self._emit(arg, "failed", arg.result)
+                        elif digest := batch.needs_split(arg.source):
+                            digests[arg.id] = digest
+                            waiting.append(arg)
+                        else:
+                            arg.status = "skipped"
+                            self._emit(arg, "skipped")
+                    elif command == "cancel":
+                        self._cancel(arg, waiting, workers)
+                    elif command == "close":
+                        closing = True
+                        for job in waiting + [worker.job for worker in workers if worker.job]: self._cancel(job.id, waiting, workers)
+
+                # Hand waiting jobs to idle workers, starting workers as they're needed
+                while waiting:
+                    worker = next((worker for worker in workers if not worker.job), None)
+                    if worker is None and len(workers) < self.workers:
+                        worker = _Worker(context, events, self.options)
+                        workers.append(worker)
+                    if worker is None: break
+                    worker.job = waiting.pop(0)
+                    worker.job.status = "running"
+                    worker.tasks.put((worker.job.id, worker.job.source, self.export_path))
+
+                try: jobId, kind, data = events.get(timeout=0.05)
+                except queue.Empty: jobId = None
+                worker = next((worker for worker in workers if worker.job and worker.job.id == jobId), None)
+                # Events of jobs that were already given up on (killed workers) are dropped
+                if worker: self._handle(batch, worker, kind, data, digests)
+
+                for worker in list(workers):
+                    # Killed for taking too long to cancel, or died (e.g. ran out of memory): its job ends, a new worker takes its place
+                    timedOut = worker.kill_at and time.monotonic() > worker.kill_at
+                    if timedOut or not worker.process.is_alive():
+                        job = worker.job
+                        worker.process.kill()
+                        workers.remove(worker)
+                        if job and timedOut: self._handle(batch, worker, "cancelled", None, digests)
+                        elif job: self._handle(batch, worker, "failed", SplitResult(job.source, error=f"Worker process exited with code {worker.process.exitcode}"), digests)
+        finally:
+            for worker in workers: worker.stop(wait=False)
+            for worker in workers: worker.stop()
+            batch.close()
+
+    def _cancel(self, job_id, waiting, workers):
+        job = self.jobs.get(job_id)
+        if job is None or job.status != "queued" and job.status != "running": return
+        if job in waiting:
+            waiting.remove(job)
+            job.status = "cancelled"
+            self._emit(job, "cancelled")
+            return
+        for worker in workers:
+            if worker.job is job and worker.kill_at is None:
+                worker.cancel.value = job_id
+                worker.kill_at = time.monotonic() + cancel_grace
+
+    def _handle(self, batch, worker, kind, data, digests):
+        job = worker.job
+        if kind == "started": job.pages = data["pages"]
+        elif kind == "progress": job.stage, job.pages_done = data["stage"], data["pages"]
+        elif kind == "question": job.questions.append(data)
+        else: # The job is over
+            worker.job, worker.kill_at = None, None
+            digest = digests.pop(job.id)
+            if kind == "cancelled":
+                # Some of its files may have been rewritten, so the paper is split again next time
+                batch.manifest.forget(job.source)
+            else:
+                if kind == "done": job.pages_done = job.pages or job.pages_done
+                # A split that can't go in the question index fails there
+                data = batch.record(data, digest)
+                if data.error: kind = "failed"
+            job.status, job.result = kind, data
+        self._emit(job, kind, data)
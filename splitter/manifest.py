@@ -0,0 +1,54 @@
+import hashlib, json, os
+
+manifest_name = "manifest.json"
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Records, for every split paper, the hash of its source PDF, the splitter version that split it
+# and the files it produced (relative to the export folder), so unchanged papers can be skipped on re-runs
+class SplitManifest:
+    def __init__(self, export_path, version):
+        self.export_path = export_path
+        self.version = version
+        self.path = os.path.join(export_path, manifest_name)
+        self.papers = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.papers = json.load(f).get("papers", {})
+
+    def _key(self, source): return os.path.basename(source)
+
+    def is_current(self, source, digest):
+        entry = self.papers.get(self._key(source))
+        return bool(entry) and entry["hash"] == digest and entry["version"] == self.version \
+            and all(os.path.exists(os.path.join(self.export_path, output)) for output in entry["outputs"])
+
+    # Store a fresh split of source and delete the outputs of its previous split that weren't written again
+    # (e.g. when a changed paper now has fewer questions)
+    def record(self, source, digest, saved_paths):
+        outputs = sorted(os.path.relpath(path, self.export_path).replace(os.sep, "/") for path in saved_paths)
+        previous = self.papers.get(self._key(source), {}).get("outputs", [])
+        orphans = sorted(set(previous) - set(outputs))
+        for orphan in orphans:
+            orphan_path = os.path.join(self.export_path, orphan)
+            if os.path.exists(orphan_path): os.remove(orphan_path)
+        self.papers[self._key(source)] = {"source": source, "hash": digest, "version": self.version, "outputs": outputs}
+        return orphans
+
+    # Make the next run split source again (after a failed or cancelled split), keeping its outputs
+    # so the next record() still deletes the ones that split doesn't write again
+    def forget(self, source):
+        entry = self.papers.get(self._key(source))
+        if entry: entry["hash"] = None
+
+    # Written to a temporary file first so an interrupted run never leaves a truncated manifest behind
+    def save(self):
+        os.makedirs(self.export_path, exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"version": self.version, "papers": self.papers}, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
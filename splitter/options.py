@@ -0,0 +1,22 @@
+# The choices of the splitter's options, kept apart from the modules using them so listing them (e.g. for command line
+# arguments) doesn't import PyMuPDF, PIL or numpy
+
+# "png" rasterizes questions at 300dpi, "pdf" crops them out of the source pages as vectors
+output_formats = ("png", "pdf")
+# How blank gaps between question blocks are found:
+#   "pixels": every row of every rendered page is scanned (the reference the coordinates layout must match)
+#   "coordinates": only the rows of a page the PDF draws something on (per MuPDF's bbox log and drawing list) are read
+#     from its rendered image. Slicing reads a third as much, but working out the rows costs about as much again,
+#     so end to end it's no faster on the benchmark papers
+layouts = ("pixels", "coordinates")
+
+# How question images can be stored: PNG colour modes for black on white scans
+#   "L": 8-bit grayscale, as rendered
+#   "P": 16 shades of gray in a 4-bit palette, about a quarter smaller with no visible loss
+#   "1": pure black and white (thresholded at 50% gray), several times smaller but loses anti-aliasing
+png_colours = ("L", "P", "1")
+
+# What QuestionIndex.replace_paper does with a question that's already indexed from another paper:
+#   "link": its row points at the first copy (duplicate_of), so the Builder can show the question once
+#   "skip": also doesn't store its image again: the file is swapped for a hard link to the first copy's
+dedupe_modes = ("link", "skip")
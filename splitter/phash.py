@@ -0,0 +1,69 @@
+import numpy as np
+from PIL import Image
+from .ink import ink_bbox
+
+# Perceptual hashes of question images, for spotting the same question split from different papers
+# (variants of a session, re-sits...) even when it doesn't come out pixel for pixel identical
+
+# Bits per side of the hash: the lowest hash_size x hash_size frequencies of a dct_size x dct_size DCT
+# Questions are mostly text, so 8x8 (the usual 64 bit pHash) can't tell similar looking blocks of text apart
+hash_size = 16
+dct_size = 64
+# Hashes at most this many bits apart (out of hash_size**2) are taken for the same question
+duplicate_distance = 24
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2*k[None, :] + 1) * k[:, None] / (2*n)) * np.sqrt(2/n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_dct = _dct_matrix(dct_size)
+
+# pHash of a question (PIL image or VectorImage) as an int of hash_size**2 bits: its ink, trimmed of margins
+# and squashed to dct_size square, goes through a 2D DCT and every low frequency above the median sets a bit
+def perceptual_hash(image):
+    small = image.reduce(max(1, image.width // (dct_size*8))).convert("L")
+    bbox = ink_bbox(small)
+    if bbox: small = small.crop(bbox)
+    pixels = np.asarray(small.resize((dct_size, dct_size), Image.BOX), np.float64)
+    low = (_dct @ pixels @ _dct.T)[:hash_size, :hash_size].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hash_hex(value): return f"{value:0{hash_size**2 // 4}x}"
+
+def hamming(a, b): return (a ^ b).bit_count()
+
+# Burkhard-Keller tree over hashes: finds every hash within a Hamming distance of a query while only visiting
+# the subtrees the triangle inequality allows, instead of comparing against every hash stored
+class BKTree:
+    def __init__(self):
+        self.root = None # [hash, items, {distance: child}]
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            if distance not in node[2]:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = node[2][distance]
+
+    # (distance, item) of every item whose hash is within radius of value, nearest first
+    def search(self, value, radius):
+        found, stack = [], [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius: found += [(distance, item) for item in node[1]]
+            stack += [child for edge, child in node[2].items() if distance - radius <= edge <= distance + radius]
+        return sorted(found, key=lambda hit: hit[0])
@@ -1,4 +1,203 @@
-import requests, bs4
+import argparse, asyncio, json, os, time
+from typing import NamedTuple
+from urllib.parse import urljoin, urlparse, unquote
+import bs4, httpx
+from .batch import BatchSplitter, source_dir
+from .manifest import file_hash
+from .splitter import export_path
+
+# Validators (ETag, Last-Modified) of every downloaded paper, kept next to the downloads so re-runs only fetch what changed
+validators_name = ".downloads.json"
+# Worth another try: the server is busy or briefly broken
+retry_statuses = {429, 500, 502, 503, 504}
+
+def paper_file_name(url): return unquote(os.path.basename(urlparse(url).path))
+
+def _is_pdf_link(url): return urlparse(url).path.lower().endswith(".pdf")
+
+# First line of an error, httpx appends a paragraph of advice to its status errors
+def _error_text(error): return f"{type(error).__name__}: {(str(error).splitlines() or [''])[0]}"
+
+class Download(NamedTuple):
+    url: str
+    path: str = None
+    status: str = "downloaded" # "downloaded", "unchanged" (304, the file on disk is current) or "failed"
+    bytes: int = 0
+    seconds: float = 0.0
+    error: str = None
+
+# Seconds to wait before retry number attempt (0 based): Retry-After if the server gave one, otherwise exponential backoff
+def _retry_delay(response, attempt, backoff):
+    retryAfter = response.headers.get("retry-after") if response is not None else None
+    if retryAfter and retryAfter.isdigit(): return min(float(retryAfter), 60)
+    return backoff * 2**attempt
+
+# Crawls a past paper index page and downloads every PDF it links to, on one pooled async HTTP client
+# Index pages are followed depth links deep (staying under the index URL), PDFs are fetched as they are found,
+# at most concurrency requests at a time. Failed requests are retried (connection errors and retry_statuses)
+# Papers already on disk are requested conditionally (If-None-Match / If-Modified-Since) and left alone on a 304
+# Every file is written under a temporary name and renamed into place, so the splitter never sees half a paper
+# transport replaces the network (e.g. httpx.MockTransport or an ASGI app's transport) for testing
+class PaperScraper:
+    def __init__(self, download_dir=source_dir, concurrency=8, retries=3, backoff=0.5, timeout=30.0, depth=0, transport=None):
+        self.download_dir = download_dir
+        self.concurrency, self.retries, self.backoff, self.timeout, self.depth = concurrency, retries, backoff, timeout, depth
+        self.transport = transport
+        self.validators_path = os.path.join(download_dir, validators_name)
+        self.validators = {}
+        if os.path.exists(self.validators_path):
+            with open(self.validators_path) as f: self.validators = json.load(f)
+
+    def _client(self):
+        return httpx.AsyncClient(transport=self.transport, timeout=self.timeout, follow_redirects=True,
+                                 limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency))
+
+    # Send a request, retrying connection errors and retry_statuses; the last response (or error) is the caller's
+    async def _request(self, client, url, headers=None):
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = await client.get(url, headers=headers)
+                if response.status_code not in retry_statuses or attempt == self.retries: return response
+            except httpx.TransportError:
+                if attempt == self.retries: raise
+            await asyncio.sleep(_retry_delay(response, attempt, self.backoff))
+
+    # Absolute URLs of the links on an index page
+    async def _links(self, client, url):
+        response = await self._request(client, url)
+        response.raise_for_status()
+        soup = bs4.BeautifulSoup(response.text, "html.parser")
+        return [urljoin(str(response.url), a["href"]).split("#")[0] for a in soup.find_all("a", href=True)]
+
+    async def _download(self, client, url):
+        start = time.perf_counter()
+        path = os.path.join(self.download_dir, paper_file_name(url))
+        known = self.validators.get(url, {})
+        headers = {}
+        if os.path.exists(path):
+            if known.get("etag"): headers["If-None-Match"] = known["etag"]
+            if known.get("last_modified"): headers["If-Modified-Since"] = known["last_modified"]
+        try:
+            response = await self._request(client, url, headers)
+            if response.status_code == 304:
+                return Download(url, path, "unchanged", seconds=time.perf_counter()-start)
+            response.raise_for_status()
+            # Error pages are often served with a 200
+            if not response.content.startswith(b"%PDF"): raise ValueError(f"{url} isn't a PDF ({response.headers.get('content-type')})")
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f: f.write(response.content)
+            os.replace(tmp, path)
+        except Exception as error:
+            return Download(url, status="failed", seconds=time.perf_counter()-start, error=_error_text(error))
+        self.validators[url] = {"etag": response.headers.get("etag"), "last_modified": response.headers.get("last-modified")}
+        return Download(url, path, "downloaded", len(response.content), time.perf_counter()-start)
+
+    # Crawl index_url and download its papers; on_download(download) is called on the event loop as each one is done
+    # Returns every Download, in the order they finished
+    async def scrape(self, index_url, on_download=None):
+        os.makedirs(self.download_dir, exist_ok=True)
+        queue, seen, downloads = asyncio.Queue(), {index_url}, []
+        queue.put_nowait((index_url, 0))
+
+        async def work(client):
+            while True:
+                url, level = await queue.get()
+                try:
+                    if _is_pdf_link(url):
+                        downloads.append(await self._download(client, url))
+                        if on_download: on_download(downloads[-1])
+                        continue
+                    try:
+                        links = await self._links(client, url)
+                    except Exception as error:
+                        downloads.append(Download(url, status="failed", error=_error_text(error)))
+                        if on_download: on_download(downloads[-1])
+                        continue
+                    for link in links:
+                        # PDFs from anywhere, index pages only below the one we started from
+                        follow = _is_pdf_link(link) or (level < self.depth and link.startswith(index_url.rsplit("/", 1)[0] + "/"))
+                        if follow and link not in seen:
+                            seen.add(link)
+                            queue.put_nowait((link, level + 1))
+                finally:
+                    queue.task_done()
+
+        async with self._client() as client:
+            workers = [asyncio.create_task(work(client)) for _ in range(self.concurrency)]
+            finished = asyncio.create_task(queue.join())
+            try:
+                done, _ = await asyncio.wait([finished, *workers], return_when=asyncio.FIRST_COMPLETED)
+                # Workers only stop by raising (e.g. from on_download): pass that on instead of waiting forever
+                for task in done: task.result()
+            finally:
+                for task in [finished, *workers]: task.cancel()
+                await asyncio.gather(finished, *workers, return_exceptions=True)
+                self.save()
+        return downloads
+
+    # Written to a temporary file first, like the split manifest
+    def save(self):
+        with open(self.validators_path + ".tmp", "w") as f: json.dump(self.validators, f, indent=1, sort_keys=True)
+        os.replace(self.validators_path + ".tmp", self.validators_path)
+
+# Download a single paper (for SplitQuestions(url, local_source=False)); returns its bytes
+def fetch_pdf(url, retries=3, backoff=0.5, timeout=30.0, transport=None):
+    with httpx.Client(transport=transport, timeout=timeout, follow_redirects=True) as client:
+        for attempt in range(retries + 1):
+            response = None
+            try:
+                response = client.get(url)
+                if response.status_code not in retry_statuses or attempt == retries: break
+            except httpx.TransportError:
+                if attempt == retries: raise
+            time.sleep(_retry_delay(response, attempt, backoff))
+    response.raise_for_status()
+    return response.content
+
+# Crawl index_url and split every paper as soon as it's downloaded, on a BatchSplitter's worker processes
+# Unchanged papers (304, or the same file the manifest already has) are skipped as usual
+# split_options go to BatchSplitter (workers, force, output_format, png_colours, compress_level, trace_path...)
+# Returns (downloads, BatchReport)
+def scrape_and_split(index_url, download_dir=source_dir, export_path=export_path, concurrency=8, retries=3, depth=0, transport=None,
+                     on_download=None, on_result=None, **split_options):
+    scraper = PaperScraper(download_dir, concurrency, retries, depth=depth, transport=transport)
+    with BatchSplitter(export_path=export_path, on_result=on_result, **split_options) as batch:
+        async def run():
+            loop, splits = asyncio.get_running_loop(), []
+            async def split(path):
+                # Hashing a whole PDF here would hold up every download in flight
+                digest = batch.needs_split(path, await loop.run_in_executor(None, file_hash, path))
+                if not digest: return
+                future = batch.submit(path, digest)
+                # A split that failed (even by taking its worker process down) is reported by collect(), not raised here
+                try: await asyncio.wrap_future(future)
+                except Exception: pass
+                batch.collect(future)
+            def downloaded(download):
+                if on_download: on_download(download)
+                if download.path: splits.append(asyncio.ensure_future(split(download.path)))
+            downloads = await scraper.scrape(index_url, downloaded)
+            await asyncio.gather(*splits)
+            return downloads
+        downloads = asyncio.run(run())
+    return downloads, batch.report
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download every question paper linked from a past paper index page and split them")
+    parser.add_argument("index", help="URL of the index page listing the papers")
+    parser.add_argument("-d", "--downloads", default=source_dir, help="Folder the papers are downloaded to")
+    parser.add_argument("-o", "--exports", default=export_path, help="Folder the split questions are saved to")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--depth", type=int, default=0, help="How many levels of index pages below the first one to follow")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Splitter worker processes (defaults to the CPU count)")
+    parser.add_argument("--no-split", action="store_true", help="Only download the papers")
+    args = parser.parse_args()
+
+    def downloaded(d): print(f"{d.status:<10} {d.url}" + (f" ({d.error})" if d.error else ""))
+    if args.no_split:
+        asyncio.run(PaperScraper(args.downloads, args.concurrency, depth=args.depth).scrape(args.index, downloaded))
+    else:
+        _, report = scrape_and_split(args.index, args.downloads, args.exports, args.concurrency, depth=args.depth, workers=args.workers, on_download=downloaded,
+                                     on_result=lambda r: print(f"{'FAILED' if r.error else 'skip  ' if r.skipped else 'done  '} {r.source} ({r.seconds:.1f}s)"))
+        print(report.summary())
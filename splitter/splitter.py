@@ -1,10 +1,30 @@
-import fitz, os
+import fitz, os, hashlib, time
 from re import compile
-from icecream import ic
-from PIL import Image, ImageOps
-from io import BytesIO
+from collections import deque
+from typing import NamedTuple
+from PIL import Image
+from .ink import InkProfile, ink_bbox
+from .text import DocumentText
+from .digits import read_question_number
+from .vector import VectorPages, ink_row_ranges
+from .trace import null_tracer
+from .writer import ImageWriter
+from .phash import perceptual_hash, hash_hex
+from .options import output_formats, layouts
 
 source_path = "source_files/4037_w12_qp_12.pdf"
+export_path = "exports"
+# Width of the grid thumbnails saved next to every question
+thumbnail_width = 400
+# Bump whenever a change alters the split output, so manifests re-split papers done by older versions
+splitter_version = 6
+# A printed question number is only trusted up to this many past the expected one (questions the split ran together):
+# a bigger jump is taken for a misread digit, which mustn't push up the names of every question after it
+number_skip_limit = 2
+
+# Stages of a split, in the order they run: the first two when SplitQuestions is created, the rest streamed by split()
+split_stages = ("first_page_info", "white_tapes", "taping", "slicing", "stitching", "numbers", "saving")
+_exhausted = object()
 
 # Converts PDF units to Image units at 300dpi
 def scaled_to_image(pdf_page_width, pdf_coords):
@@ -14,68 +34,204 @@ def scaled_to_image(pdf_page_width, pdf_coords):
     if type(pdf_coords) in {list, tuple}:
         return [round(x * scale_factor) for x in pdf_coords]
 
-# PDF page to bytes
-def P2B(page): return BytesIO(page.get_pixmap(dpi=300).tobytes("png"))
+# PDF page to grayscale image, built straight from the pixmap samples (no PNG round-trip)
+def P2I(page, dpi=300, tracer=null_tracer):
+    with tracer.span("render", page=page.number, dpi=dpi) as span:
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        if tracer.enabled: span.update(bytes=len(pix.samples_mv), size=(pix.width, pix.height))
+    return Image.frombuffer('L', (pix.width, pix.height), pix.samples, 'raw', 'L', pix.stride, 1)
+
+# Hash of an image's pixels (and size), independent of how it gets encoded on disk
+def image_hash(img):
+    return hashlib.sha256(f"{img.mode}{img.size}".encode() + img.tobytes()).hexdigest()
+
+# Small copy of a question for the Builder grid, saved under its content hash so identical questions share one file
+# Always 8-bit grayscale, whatever the questions are stored as. Returns its path relative to the export folder
+def save_thumbnail(img, exportPath, contentHash, writer, width=thumbnail_width):
+    path = f"thumbnails/{contentHash}.png"
+    if not os.path.exists(f"{exportPath}/{path}"):
+        writer.write(img.reduce(max(1, -(-img.width // width))), f"{exportPath}/{path}", colours="L")
+    return path
+
+# Renders each page of a document at most once per run
+# Stages reserve the pages they will read up front; a page is freed as soon as its last reader takes it
+class PageRasterCache:
+    def __init__(self, source, dpi=300, tracer=null_tracer):
+        self.source = source
+        self.dpi = dpi
+        self.tracer = tracer
+        self._rasters = {}
+        self._pending = {}
+
+    def reserve(self, page_number, count=1):
+        self._pending[page_number] = self._pending.get(page_number, 0) + count
+
+    # Returned images are shared while other readers are pending, so ask for a writable copy before pasting on them
+    def take(self, page_number, writable=False):
+        image = self._rasters.pop(page_number, None)
+        if image is None:
+            image = P2I(self.source[page_number], self.dpi, self.tracer)
+        pending = self._pending.pop(page_number, 0) - 1
+        if pending > 0:
+            self._pending[page_number] = pending
+            self._rasters[page_number] = image
+            return image.copy() if writable else image
+        return image
+
+    def blank(self, size): return Image.new('L', size, 255)
+
+    # Row ranges of a page's image that can hold ink once tapes are pasted on it and pasted boxes added (see ink_row_ranges)
+    def ink_rows(self, page_number, image, tapes=(), pasted=()):
+        return ink_row_ranges(self.source[page_number], self.dpi/72, image.height, tapes, pasted)
+
+# A finished question, as emitted by SplitQuestions.split()
+class Question(NamedTuple):
+    name: str # File name without extension, e.g. 4037_w12_qp_12_3 or 4037_w12_qp_12_11E
+    number: int # As printed on the paper, or the question's position if it couldn't be read
+    image: Image.Image # Or a VectorImage when splitting to PDF
+    id_strip: Image.Image
+    paths: tuple # Where the question and its id strip were saved
+    pages: tuple # (first, last) PDF page index the question was cut from
 
 class SplitQuestions:
-    def __init__(self, filepath : str = source_path, local_source = True):
-        # Assuming PDF is in local storage
-        file_name = ""
+    # With eager=False nothing is rendered until split() is iterated
+    # output_format "pdf" saves every question and id strip as a small vector PDF instead of a PNG
+    # stage_hook(stage, item), if given, is called with every item a split stage produces (see split_stages)
+    # tracer (see trace.py) records spans around every stage, page render, text extraction and save
+    # PNGs are written on write_threads background threads, at compress_level (0-9), in png_colours (see writer.py)
+    # layout picks how the gaps between question blocks are found (see layouts); both give the same questions
+    def __init__(self, filepath : str = source_path, local_source = True, export_path : str = export_path, eager = True, output_format = "png", stage_hook = None, tracer = null_tracer,
+                 write_threads = 2, compress_level = 6, png_colours = "L", layout = layouts[0]):
+        # A local path, or with local_source=False the URL of the PDF, which is downloaded into memory
         if local_source:
-            file_name = os.path.splitext(os.path.split(filepath)[-1])[0]
+            self.file_name = os.path.splitext(os.path.split(filepath)[-1])[0]
+            source = fitz.open(filepath)
         else:
-            pass # Fetch URL header of PDF
+            # Imported here: the scraper builds on the batch splitter, which imports this module
+            from .scraper import fetch_pdf, paper_file_name
+            self.file_name = os.path.splitext(paper_file_name(filepath))[0]
+            source = fitz.open(stream=fetch_pdf(filepath), filetype="pdf")
 
         # Initialize primary variables
-        source = fitz.open(filepath)
+        self.source = source
+        self.export_path = export_path
+        if output_format not in output_formats: raise ValueError(f"Can't save questions as {output_format!r}, only as {' or '.join(output_formats)}")
+        self.output_format = output_format
+        if layout not in layouts: raise ValueError(f"Unknown layout {layout!r}, expected one of {', '.join(layouts)}")
+        self.layout = layout
+        self.stage_hook = stage_hook
+        self.tracer = tracer
+        self.write_threads, self.compress_level, self.png_colours = write_threads, compress_level, png_colours
+        # Seconds spent in each stage of split_stages, excluding the stages feeding it
+        self.stage_seconds = dict.fromkeys(split_stages, 0.0)
+        start = time.perf_counter()
+        # Text of every page is extracted once and shared by all the detection steps
+        page_texts = DocumentText(source, tracer)
         paper_id_pattern = compile(r'\d{4}/\d{2}/[A-Z]/[A-Z]/\d{2}')
-        start_page, page_num_elem, paper_id_elem, q1_elem, examiner_use_elem = self._get_first_page_info(source, paper_id_pattern)
+        with tracer.span("first_page_info"):
+            self.start_page, page_num_elem, self.paper_id_elem, self.q1_elem, examiner_use_elem = self._get_first_page_info(source, page_texts, paper_id_pattern)
         # All 'elem' variables store a tuple of information about piece of text in the PDF
         # E.g.: (topLeftX, topLeftY, bottomRightX, bottomRightY, text, blockNum, lineNum, wordNum)
 
         # ic(start_page, page_num_elem, paper_id_elem, q1_elem, examiner_use_elem)
+        self.stage_seconds["first_page_info"] = time.perf_counter() - start
 
         # Calculate the size of page,
         # the size of the gap between questions
         # the (image) coordinates of page number, left indentation (where question number exists), & right indentation (examiner's use)
-        page_width, page_height = source[0].mediabox.width, source[0].mediabox.height
-        one_line_gap = q1_elem[3] - q1_elem[1]
-        one_line_gap_img = scaled_to_image(page_width, one_line_gap)
+        self.page_width = page_width = source[0].mediabox.width
+        page_height = source[0].mediabox.height
+        one_line_gap = self.q1_elem[3] - self.q1_elem[1]
+        self.one_line_gap_img = scaled_to_image(page_width, one_line_gap)
         page_num_tape = scaled_to_image(page_width, [0, page_num_elem[1], page_width, page_num_elem[3]])
-        qp_num_tape = scaled_to_image(page_width, [0, paper_id_elem[3]-one_line_gap, page_width, paper_id_elem[3]+one_line_gap])
+        qp_num_tape = scaled_to_image(page_width, [0, self.paper_id_elem[3]-one_line_gap, page_width, self.paper_id_elem[3]+one_line_gap])
         examiner_use_tape = scaled_to_image(page_width, [examiner_use_elem[0]-one_line_gap/2, 0, page_width, page_height]) if examiner_use_elem else None
 
-        white_pasties, either_or_location = self._get_white_tapes(source, start_page, page_num_tape, qp_num_tape, examiner_use_tape, page_width, page_height, one_line_gap)
-
-        # Get list of whited out images (excluding either/or questions)
-        self.taped_image_list = self._get_taped_image_list(source, white_pasties)
-
-        # Append whited out either/or if available
-        self.taped_image_list = self._get_taped_either_or(source, self.taped_image_list, either_or_location, one_line_gap_img)
-
-        # Get list of question line slices
-        self.sliced_image_list = self._get_sliced_image_list(self.taped_image_list, one_line_gap_img, page_width)
-
-        # Get list of stitched questions
-        self.stitched_image_list, right_bounds_image = self._get_stitched_image_list(self.sliced_image_list, page_width, q1_elem, one_line_gap_img)
-
-        # Get stitched questions without question numbers (and maybe also include question paper numbers)
-        self.stitched_image_list, self.question_number_coordinates, self.paper_id_strips = self._remove_questions_numbers(source, start_page, page_width, self.stitched_image_list, right_bounds_image, paper_id_elem, one_line_gap_img, len(either_or_location))
-
-        # Save images
-        self._save_split_images(file_name, self.stitched_image_list, self.paper_id_strips, len(either_or_location))
-
+        start = time.perf_counter()
+        with tracer.span("white_tapes"):
+            self.white_pasties, self.either_or_location = self._get_white_tapes(source, page_texts, self.start_page, page_num_tape, qp_num_tape, examiner_use_tape, page_width, page_height, one_line_gap)
+        self.stage_seconds["white_tapes"] = time.perf_counter() - start
+
+        self.question_number_coordinates = []
+        # (expected, read) for every question whose printed number doesn't follow on from the previous one
+        self.question_number_mismatches = []
+        self.saved_paths = []
+        # One dict of metadata per saved question, ready for the question index
+        self.question_records = []
+        if eager:
+            for _ in self.split(): pass
+
+    @property
+    def question_count(self): return len(self.question_number_coordinates)
+
+    # Streams the paper through page -> tapes -> slices -> questions -> saved files,
+    # yielding each Question as soon as it is queued for saving (every file is on disk once split() finishes). Only the page being sliced, the slices of the question being
+    # stitched and (for either/or papers) the last two questions are held in memory at any time
+    def split(self):
+        pageWidth, oneLineGapImg = self.page_width, self.one_line_gap_img
+        eitherOrExists = len(self.either_or_location)
+
+        self._hook_seconds = dict.fromkeys(split_stages, 0.0)
+
+        # Reserve every page raster the stages below will read, so each page is rendered once and freed after its last use
+        # Vector output never renders whole pages: the stages work on VectorImages that only record what goes where
+        rasters = VectorPages(self.source, pageWidth, tracer=self.tracer) if self.output_format == "pdf" else PageRasterCache(self.source, tracer=self.tracer)
+        for page_number in self.white_pasties: rasters.reserve(page_number)
+        rasters.reserve(self.start_page)
+        # Vector questions are saved on this thread: they read the source document, which can't be shared between threads
+        writer = ImageWriter(self.write_threads if self.output_format == "png" else 0, self.compress_level, self.png_colours, tracer=self.tracer)
+
+        try:
+            # Grab Paper ID (before the start page gets taped over)
+            paperIdBlock = rasters.take(self.start_page).crop(scaled_to_image(pageWidth, self.paper_id_elem[:4]))
+            rBoundImg = scaled_to_image(pageWidth, self.q1_elem[2])
+
+            # Whited out pages, with the either/or question numbers moved into place
+            # With the coordinates layout, inkRows gets the rows of each taped page that can hold ink, for the slicer to read
+            inkRows = {} if self.layout == "coordinates" else None
+            pages = self._timed("taping", self._iter_taped_images(rasters, self.white_pasties, self.either_or_location, oneLineGapImg, inkRows))
+            # Question line slices
+            slices = self._timed("slicing", self._iter_sliced_images(pages, oneLineGapImg, pageWidth, inkRows))
+            # Stitched questions
+            questions = self._timed("stitching", self._iter_stitched_images(slices, rBoundImg, oneLineGapImg, rasters.blank))
+            # Stitched questions without question numbers, alongside their paper ID strips
+            questions = self._timed("numbers", self._iter_unnumbered_questions(questions, pageWidth, rBoundImg, paperIdBlock, oneLineGapImg, rasters.blank, eitherOrExists))
+            # Save images
+            yield from self._timed("saving", self._save_split_images(self.export_path, self.file_name, questions, writer))
+            writer.flush()
+        finally:
+            writer.shutdown()
+            self.source.close()
+            # Each stage was timed including the stages it pulls from (and their hook calls); keep only its own share
+            streamed = split_stages[split_stages.index("taping"):]
+            for upstream, stage in reversed(list(zip(streamed, streamed[1:]))):
+                self.stage_seconds[stage] -= self.stage_seconds[upstream] + self._hook_seconds[upstream]
+
+    # Passes a stage's items through, adding the time taken to produce each one (upstream stages included) to stage_seconds
+    def _timed(self, stage, items):
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            with self.tracer.span(stage):
+                item = next(items, _exhausted)
+            self.stage_seconds[stage] += time.perf_counter() - start
+            if item is _exhausted: return
+            if self.stage_hook:
+                start = time.perf_counter()
+                self.stage_hook(stage, item)
+                self._hook_seconds[stage] += time.perf_counter() - start
+            yield item
 
     # Find first page, store q1_elem and qnNumElem
-    def _get_first_page_info(self, source, paper_id_pattern):
+    def _get_first_page_info(self, source, pageTexts, paper_id_pattern):
         start_page, page_num_elem, paper_id_elem, q1_elem, examiner_use_elem = None, None, None, None, None
         for page in source.pages(1):
-            page_words = page.get_text('words')
-            for word in page_words[1:25]:
+            text = pageTexts[page.number]
+            for word in text.words[1:25]:
                 if not paper_id_elem and paper_id_pattern.match(word[4]):
                     paper_id_elem = word
-                if not q1_elem and word[-1] == 0 and word[4] == '1' and word[2] < page.mediabox.width/8:
-                    q1_elem, page_num_elem, start_page = word, page_words[0], page.number
+                if not q1_elem and word[-1] == 0 and word[4] == '1' and word[2] < text.width/8:
+                    q1_elem, page_num_elem, start_page = word, text.words[0], page.number
                 if not examiner_use_elem and 'Examiner' in word[4]:
                     examiner_use_elem = word
             if q1_elem and paper_id_elem: break
@@ -83,138 +239,120 @@ class SplitQuestions:
         return start_page, page_num_elem, paper_id_elem, q1_elem, examiner_use_elem
     
     # Store all the (image) locations that need to be blocked out by white 'tapes'
-    def _get_white_tapes(self, file, startPage, pageNumTape, qpNumTape, examinerUseTape, pageWidth, pageHeight, oneLineGap):
+    def _get_white_tapes(self, file, pageTexts, startPage, pageNumTape, qpNumTape, examinerUseTape, pageWidth, pageHeight, oneLineGap):
         whitePasties = {}
         eitherOrLoc = []
         skipRemainingPages = False
-        for page in file.pages(startPage):
-            blankFound = False
-            for block in page.get_text('blocks'):
-                if 'BLANK PAGE' in block[4]: blankFound = True; break
-            if blankFound: continue
+        for pageNumber in range(startPage, len(file)):
+            text = pageTexts[pageNumber]
+            if text.is_blank: continue
             if skipRemainingPages: break
-            pageWords = page.get_text('words')
-            whitePasties[page.number] = []
-            whitePasties[page.number].append(pageNumTape)
-            whitePasties[page.number].append(qpNumTape)
-            # if examinerUseElem: whitePasties[page.number].append(examinerUseTape)
-            if examinerUseTape: whitePasties[page.number].append(examinerUseTape)
-            for word in pageWords:
-                if '......' in word[4] and word[2]-word[0]>pageWidth/2 and not '[' in word[4]:
-                    whitePasties[page.number].append(scaled_to_image(pageWidth,word[:4]))
-                if 'Section' in word[4] and word[0] / (pageWidth-word[2]) > 0.9:
-                    whitePasties[page.number].append(scaled_to_image(pageWidth, [0,word[1],pageWidth,word[3]+oneLineGap*2]))
-                if ('EITHER' in word[4] or 'OR' in word[4]):
-                    if word[0]<pageWidth/4:
-                        eitherOrLoc.append(scaled_to_image(pageWidth,word[:4])+[page.number]+[len(whitePasties)-1])
-                    else:
-                        whitePasties[page.number].append(scaled_to_image(pageWidth, [0,word[1]-oneLineGap*2,pageWidth,pageHeight]))
-                        skipRemainingPages = True
-                if 'Answer' in word[4] and word[-1] == 0:
-                    whitePasties[page.number].append(scaled_to_image(pageWidth,[word[0],word[1],pageWidth,word[3]]))
-
-            for block in page.get_text('blocks'):
-                if 'Additional page' in block[4]:
-                    whitePasties[page.number].append(scaled_to_image(pageWidth,[0,block[1],pageWidth,pageHeight]))
+            whitePasties[pageNumber] = []
+            whitePasties[pageNumber].append(pageNumTape)
+            whitePasties[pageNumber].append(qpNumTape)
+            # if examinerUseElem: whitePasties[pageNumber].append(examinerUseTape)
+            if examinerUseTape: whitePasties[pageNumber].append(examinerUseTape)
+            for word in text.words_containing('......'):
+                if word[2]-word[0]>pageWidth/2 and not '[' in word[4]:
+                    whitePasties[pageNumber].append(scaled_to_image(pageWidth,word[:4]))
+            for word in text.words_containing('Section'):
+                if word[0] / (pageWidth-word[2]) > 0.9:
+                    whitePasties[pageNumber].append(scaled_to_image(pageWidth, [0,word[1],pageWidth,word[3]+oneLineGap*2]))
+            for word in text.words_containing('EITHER', 'OR'):
+                if word[0]<pageWidth/4:
+                    eitherOrLoc.append(scaled_to_image(pageWidth,word[:4])+[pageNumber]+[len(whitePasties)-1])
+                else:
+                    whitePasties[pageNumber].append(scaled_to_image(pageWidth, [0,word[1]-oneLineGap*2,pageWidth,pageHeight]))
                     skipRemainingPages = True
-                if page.number == len(file)-1 and not blankFound and "Permission to reproduce items" in block[4]:
-                    whitePasties[page.number].append(scaled_to_image(pageWidth,[0,block[1]-oneLineGap,pageWidth,pageHeight]))
+            for word in text.words_containing('Answer'):
+                if word[-1] == 0:
+                    whitePasties[pageNumber].append(scaled_to_image(pageWidth,[word[0],word[1],pageWidth,word[3]]))
+
+            for block in text.blocks_containing('Additional page'):
+                whitePasties[pageNumber].append(scaled_to_image(pageWidth,[0,block[1],pageWidth,pageHeight]))
+                skipRemainingPages = True
+            if pageNumber == len(file)-1:
+                for block in text.blocks_containing("Permission to reproduce items"):
+                    whitePasties[pageNumber].append(scaled_to_image(pageWidth,[0,block[1]-oneLineGap,pageWidth,pageHeight]))
         
         return whitePasties, eitherOrLoc
 
     # Convert each page to image and 'paste' the white tapes
-    def _get_taped_image_list(self, file, whitePasties):
-        tapedImgList = []
+    # The either/or question number is lifted off its clean page, then pasted just below the EITHER and OR labels
+    def _iter_taped_images(self, rasters, whitePasties, eitherOrLoc, oneLineGapImg, inkRows=None):
+        eitherQuesImgCropped = None
         for k, v in whitePasties.items():
-            pageImg = Image.open(P2B(file[k]))
+            pageImg = rasters.take(k, writable=True)
+            pasted = []
+            if eitherOrLoc and k == eitherOrLoc[0][-2]:
+                eitherQuesImg = pageImg.crop([0,eitherOrLoc[0][1]-oneLineGapImg*2,eitherOrLoc[0][0],eitherOrLoc[0][3]+oneLineGapImg*2])
+                eitherQuesBbox = ink_bbox(eitherQuesImg)
+                eitherQuesImgCropped = eitherQuesImg.crop(eitherQuesBbox)
+
             for _, x in enumerate(v):
-                tape = Image.new('L', (x[2]-x[0], x[3]-x[1]), 255)
+                tape = rasters.blank((x[2]-x[0], x[3]-x[1]))
                 pageImg.paste(tape, x)
-            tapedImgList.append(pageImg)
-        
-        return tapedImgList
 
-    def _get_taped_either_or(self, file, tapedImgList, eitherOrLoc, oneLineGapImg):
-        if len(eitherOrLoc) > 0:
-            eitherPageImg = Image.open(P2B(file[eitherOrLoc[0][-2]]))
-            eitherQuesImg = eitherPageImg.crop([0,eitherOrLoc[0][1]-oneLineGapImg*2,eitherOrLoc[0][0],eitherOrLoc[0][3]+oneLineGapImg*2])
-            eitherQuesBbox = ImageOps.invert(eitherQuesImg).getbbox()
-            eitherQuesImgCropped = eitherQuesImg.crop(eitherQuesBbox)
+            if eitherQuesImgCropped and k == eitherOrLoc[0][-2]:
+                pageImg.paste(rasters.blank((eitherQuesImgCropped.width,eitherQuesImgCropped.height)), (eitherQuesBbox[0], eitherOrLoc[0][1]-oneLineGapImg*2+eitherQuesBbox[1]))
+                pageImg.paste(eitherQuesImgCropped, (eitherQuesBbox[0], eitherOrLoc[0][1]+oneLineGapImg*2//10))
+                pasted.append((eitherQuesBbox[0], eitherOrLoc[0][1]+oneLineGapImg*2//10, eitherQuesBbox[0]+eitherQuesImgCropped.width, eitherOrLoc[0][1]+oneLineGapImg*2//10+eitherQuesImgCropped.height))
+            if eitherQuesImgCropped and len(eitherOrLoc) > 1 and k == eitherOrLoc[1][-2]:
+                pageImg.paste(eitherQuesImgCropped, (eitherQuesBbox[0], eitherOrLoc[1][1]+oneLineGapImg*2//10))
+                pasted.append((eitherQuesBbox[0], eitherOrLoc[1][1]+oneLineGapImg*2//10, eitherQuesBbox[0]+eitherQuesImgCropped.width, eitherOrLoc[1][1]+oneLineGapImg*2//10+eitherQuesImgCropped.height))
 
-            tapedImgList[eitherOrLoc[0][-1]].paste(Image.new('L',(eitherQuesImgCropped.width,eitherQuesImgCropped.height),255), (eitherQuesBbox[0], eitherOrLoc[0][1]-oneLineGapImg*2+eitherQuesBbox[1]))
-            tapedImgList[eitherOrLoc[0][-1]].paste(eitherQuesImgCropped, (eitherQuesBbox[0], eitherOrLoc[0][1]+oneLineGapImg*2//10))
-            tapedImgList[eitherOrLoc[1][-1]].paste(eitherQuesImgCropped, (eitherQuesBbox[0], eitherOrLoc[1][1]+oneLineGapImg*2//10))
+            if inkRows is not None: inkRows[k] = rasters.ink_rows(k, pageImg, v, pasted)
+            yield k, pageImg
 
-        return tapedImgList
-    
     # Slice up each page image into question block snippets
-    def _get_sliced_image_list(self, tapedImgList, oneLineGapImg, pageWidth):
-        slicedImgList = []
+    # inkRows, if given, holds the rows of each page that can hold ink (filled in by _iter_taped_images): only those are read
+    def _iter_sliced_images(self, tapedImages, oneLineGapImg, pageWidth, inkRows=None):
         checkHeight, pageWidthImg = int(oneLineGapImg*1.5), scaled_to_image(pageWidth, pageWidth)
 
-        for img in tapedImgList:
-            keepBox = [0,0,pageWidthImg,checkHeight]
-            pixel = 0
-            gapFoundBefore = False
-            while pixel < img.height:
-                checkBottom = pixel+checkHeight if pixel+checkHeight<img.height else img.height
-                checkBox = ImageOps.invert(img.crop([0,pixel,pageWidthImg,checkBottom])).getbbox()
-                if checkBox:
-                    if not gapFoundBefore:
-                        keepBox[3] = pixel+checkBox[3]
-                        pixel += checkBox[3]
-                    else:
-                        keepBox[1], keepBox[3] = pixel+checkBox[1], pixel+checkBox[3]
-                        gapFoundBefore = False
-                        pixel += checkBox[1]
-                else:
-                    if not gapFoundBefore:
-                        if pixel != 0 and not keepBox[3]-keepBox[1]<oneLineGapImg//2:
-                            slicedImgList.append(img.crop(keepBox))
-                        gapFoundBefore = True
-                    pixel += checkHeight
-                    keepBox[1], keepBox[3] = pixel, pixel
-            if keepBox[3]-keepBox[1] != 0:
-                slicedImgList.append(img.crop(keepBox))
-        
-        return slicedImgList
+        for pageNumber, img in tapedImages:
+            candidateRows = inkRows.pop(pageNumber, None) if inkRows else None
+            for top, bottom in InkProfile(img, candidateRows).bands(checkHeight, oneLineGapImg//2, pageWidthImg):
+                yield pageNumber, img.crop([0,top,pageWidthImg,bottom])
     
-    def _get_stitched_image_list(self, slicedImgList, pageWidth, q1Elem, oneLineGapImg):
-        stitchedImgList = []
-        rBoundImg = scaled_to_image(pageWidth, q1Elem[2])
-        for img in slicedImgList:
-            potentialQuestion = ImageOps.invert(img.crop([0,0,rBoundImg,img.height])).getbbox()
+    # Group slices into questions (a slice with a question number in the left margin starts a new one)
+    # and compose each question once, with a one line gap between its slices, as soon as the next one starts
+    # Yields (question, (first page, last page))
+    def _iter_stitched_images(self, slices, rBoundImg, oneLineGapImg, blank):
+        questionSlices = []
+        for pageNumber, img in slices:
+            potentialQuestion = ink_bbox(img, [0,0,rBoundImg,img.height])
             if potentialQuestion and oneLineGapImg//3 <= potentialQuestion[3]-potentialQuestion[1] <= oneLineGapImg:
-                stitchedImgList.append(img)
-            else:
-                newImg = Image.new('L',(img.width,stitchedImgList[-1].height+oneLineGapImg), 255)
-                newImg.paste(stitchedImgList[-1])
-                stitchedImgList[-1] = newImg
-
-                newImg = Image.new('L',(img.width,stitchedImgList[-1].height+img.height), 255)
-                newImg.paste(stitchedImgList[-1])
-                newImg.paste(img,(0,stitchedImgList[-1].height))
-                stitchedImgList[-1] = newImg
-        
-        return stitchedImgList, rBoundImg
+                if questionSlices: yield self._compose_question(questionSlices, oneLineGapImg, blank)
+                questionSlices = [(pageNumber, img)]
+            elif questionSlices: # Anything before the first question number isn't part of a question
+                questionSlices.append((pageNumber, img))
+        if questionSlices: yield self._compose_question(questionSlices, oneLineGapImg, blank)
+
+    def _compose_question(self, pageSlices, oneLineGapImg, blank):
+        pages, slices = (pageSlices[0][0], pageSlices[-1][0]), [img for _, img in pageSlices]
+        if len(slices) == 1: return slices[0], pages
+        questionImg = blank((max(img.width for img in slices), sum(img.height for img in slices)+oneLineGapImg*(len(slices)-1)))
+        top = 0
+        for img in slices:
+            questionImg.paste(img, (0, top))
+            top += img.height + oneLineGapImg
+        return questionImg, pages
     
-    def _remove_questions_numbers(self, file, startPage, pageWidth, stitchedImgList, rBoundImg, qpNumElem, oneLineGapImg, eitherOrExists=0):
-        qCoordsList = []
-        paperIdStrips = []
-        whiteTape = Image.new('L', (rBoundImg+oneLineGapImg, int(oneLineGapImg*1.5)), 255)
+    # Yields (question, paper ID strip, printed question number, either/or suffix, page span) for every stitched question
+    # For either/or papers the last two questions are the EITHER and OR alternatives, so two questions are held back
+    def _iter_unnumbered_questions(self, stitchedImages, pageWidth, rBoundImg, paperIdGrabbedBlock, oneLineGapImg, blank, eitherOrExists=0):
+        whiteTape = blank((rBoundImg+oneLineGapImg, int(oneLineGapImg*1.5)))
         pageWidthImg = scaled_to_image(pageWidth, pageWidth)
 
-        # Grab Paper ID
-        paperIdGrabbedBlock = Image.open(P2B(file[startPage])).crop(scaled_to_image(pageWidth, qpNumElem[:4]))
-
-        for idx, img in enumerate(stitchedImgList):
+        for (img, pages), questionsLeft in _look_ahead(stitchedImages, 2 if eitherOrExists > 0 else 0):
             # Grab Question Number
             croppedQuestionNum = img.crop((0, 0, rBoundImg+oneLineGapImg, int(oneLineGapImg*1.5)))
-            croppedBoundBox = ImageOps.invert(croppedQuestionNum).getbbox()
-            qCoordsList.append(croppedBoundBox)
+            croppedBoundBox = ink_bbox(croppedQuestionNum)
+            self.question_number_coordinates.append(croppedBoundBox)
+            questionNumber, _ = read_question_number(croppedQuestionNum.crop(croppedBoundBox))
 
             # Append question number to paper ID
-            longStrip = Image.new('L', (pageWidthImg, oneLineGapImg*2), 255)
+            longStrip = blank((pageWidthImg, oneLineGapImg*2))
             longStrip.paste(croppedQuestionNum.crop(croppedBoundBox), (pageWidthImg-oneLineGapImg*2, int(oneLineGapImg*0.5)))
             longStrip.paste(paperIdGrabbedBlock, (pageWidthImg-oneLineGapImg*3-paperIdGrabbedBlock.width, int(oneLineGapImg*0.5)))
 
@@ -222,35 +360,63 @@ class SplitQuestions:
             img.paste(whiteTape)
 
             # Handle Either/Or
-            if idx >= len(stitchedImgList)-2 and eitherOrExists > 0:
+            suffix = ""
+            if questionsLeft < 2 and eitherOrExists > 0:
                 eitherOrPart = img.crop((0, 0, pageWidthImg//2, oneLineGapImg))
-                eitherOrPart = eitherOrPart.crop(ImageOps.invert(eitherOrPart).getbbox())
+                eitherOrPart = eitherOrPart.crop(ink_bbox(eitherOrPart))
                 longStrip.paste(eitherOrPart, (pageWidthImg-oneLineGapImg*4-paperIdGrabbedBlock.width-eitherOrPart.width, int(oneLineGapImg*0.5)))
                 # longStrip.save(f"boss{idx}.png")
 
                 questionPart = img.crop((0, oneLineGapImg, pageWidthImg, img.height))
-                questionPart = questionPart.crop(ImageOps.invert(questionPart).getbbox())
-                stitchedImgList[idx] = questionPart
+                img = questionPart.crop(ink_bbox(questionPart))
+                suffix = "E" if questionsLeft == 1 else "O"
 
-            paperIdStrips.append(longStrip)
-        
-        return stitchedImgList, qCoordsList, paperIdStrips
+            yield img, longStrip, questionNumber, suffix, pages
     
-    def _save_split_images(self, filename, image_list, strip_list, eitherOrExists=0):
+    def _save_split_images(self, exportPath, filename, questions, writer):
         # filename = os.path.splitext(filename)[0]
-        if not os.path.exists("exports"):
-            os.makedirs("exports/questions")
-            os.makedirs("exports/question_ids")
-        for idx, (img, strip) in enumerate(zip(image_list, strip_list)):
-            save_name = ""
-            if idx < len(image_list)-2:
-                save_name = f"{filename}_{idx+1}.png"
-            else:
-                if eitherOrExists > 0:
-                    save_name = f"{filename}_{idx+1}E.png" if idx == len(image_list)-2 else f"{filename}_{idx}O.png"
-
-            img.save(f"exports/questions/{save_name}")
-            strip.save(f"exports/question_ids/{save_name}")
+        # exist_ok: several batch workers may be creating the folders at once
+        os.makedirs(f"{exportPath}/questions", exist_ok=True)
+        os.makedirs(f"{exportPath}/question_ids", exist_ok=True)
+        os.makedirs(f"{exportPath}/thumbnails", exist_ok=True)
+        expected, used = 1, set()
+        for img, strip, questionNumber, suffix, pages in questions:
+            # Both alternatives of an either/or question share its number
+            if suffix == 'O': expected -= 1
+            if questionNumber is not None and questionNumber != expected: self.question_number_mismatches.append((expected, questionNumber))
+            # Name by the printed number, so one bad split doesn't shift the names of every question after it, unless it
+            # looks misread: going backwards or already taken (it would overwrite an earlier question) or too far ahead
+            if questionNumber is None or not expected <= questionNumber <= expected + number_skip_limit or (questionNumber, suffix) in used:
+                questionNumber = expected
+            used.add((questionNumber, suffix))
+            expected = questionNumber + 1
+            save_name = f"{filename}_{questionNumber}{suffix}"
+
+            extension = self.output_format
+            paths = (f"{exportPath}/questions/{save_name}.{extension}", f"{exportPath}/question_ids/{save_name}.{extension}")
+            writer.write(img, paths[0])
+            writer.write(strip, paths[1])
+            self.saved_paths += paths
+            # Thumbnails are a shared cache rather than outputs of this paper, so they stay out of saved_paths
+            contentHash = image_hash(img)
+            self.question_records.append({
+                "paper": filename, "paper_id": self.paper_id_elem[4], "number": questionNumber, "either_or": suffix,
+                "first_page": pages[0], "last_page": pages[1],
+                "image_path": f"questions/{save_name}.{extension}", "id_strip_path": f"question_ids/{save_name}.{extension}",
+                "thumbnail_path": save_thumbnail(img, exportPath, contentHash, writer),
+                "width": img.width, "height": img.height, "content_hash": contentHash, "phash": hash_hex(perceptual_hash(img)),
+            })
+            yield Question(save_name, questionNumber, img, strip, paths, pages)
+
+# Yields (item, itemsLeft) where itemsLeft counts the items still to come, but never more than lookahead
+def _look_ahead(items, lookahead):
+    buffer = deque()
+    for item in items:
+        buffer.append(item)
+        if len(buffer) > lookahead: yield buffer.popleft(), lookahead
+    while buffer:
+        item = buffer.popleft()
+        yield item, len(buffer)
 
 
 
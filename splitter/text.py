@@ -0,0 +1,45 @@
+import fitz
+from .trace import null_tracer
+
+# Everything the detection stages need to know about the text of one page, extracted from a single textpage
+# Words and blocks keep PyMuPDF's tuple layout:
+# words:  (topLeftX, topLeftY, bottomRightX, bottomRightY, text, blockNum, lineNum, wordNum)
+# blocks: (topLeftX, topLeftY, bottomRightX, bottomRightY, text, blockNum, blockType)
+class PageText:
+    def __init__(self, page, tracer=null_tracer):
+        with tracer.span("get_text", page=page.number) as span:
+            # 'words' and 'blocks' share the same extraction flags, so one textpage serves both
+            textpage = page.get_textpage(flags=fitz.TEXTFLAGS_WORDS)
+            self.words = page.get_text('words', textpage=textpage)
+            self.blocks = page.get_text('blocks', textpage=textpage)
+            span.update(words=len(self.words))
+        self.number = page.number
+        self.width, self.height = page.mediabox.width, page.mediabox.height
+        self._word_hits, self._block_hits = {}, {}
+
+    # Words (in reading order) whose text contains any of the keywords
+    def words_containing(self, *keywords):
+        if keywords not in self._word_hits:
+            self._word_hits[keywords] = [w for w in self.words if any(k in w[4] for k in keywords)]
+        return self._word_hits[keywords]
+
+    # Blocks (in reading order) whose text contains any of the keywords
+    def blocks_containing(self, *keywords):
+        if keywords not in self._block_hits:
+            self._block_hits[keywords] = [b for b in self.blocks if any(k in b[4] for k in keywords)]
+        return self._block_hits[keywords]
+
+    @property
+    def is_blank(self): return bool(self.blocks_containing('BLANK PAGE'))
+
+# Lazily built PageText for every page of a document, so each page is only ever extracted once
+class DocumentText:
+    def __init__(self, source, tracer=null_tracer):
+        self.source = source
+        self.tracer = tracer
+        self._pages = {}
+
+    def __getitem__(self, page_number):
+        if page_number not in self._pages:
+            self._pages[page_number] = PageText(self.source[page_number], self.tracer)
+        return self._pages[page_number]
@@ -0,0 +1,69 @@
+import json, os, threading, time
+
+# Spans around the splitter's hot paths (stages, page renders, text extraction, saves), recorded as
+# Chrome trace "complete" events: {"name", "ph": "X", "ts", "dur" (microseconds), "pid", "tid", "args"}
+# The same dicts are written one per line for JSON lines, or wrapped in {"traceEvents": [...]} for chrome://tracing / Perfetto
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer, self.name, self.args = tracer, name, args
+
+    # The span's args are returned so sizes known only at the end (bytes written...) can be added to them
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self.args
+
+    def __exit__(self, *_):
+        end = time.perf_counter_ns()
+        self.tracer.events.append({"name": self.name, "ph": "X", "ts": self.start / 1000, "dur": (end - self.start) / 1000,
+                                   "pid": os.getpid(), "tid": threading.get_ident(), "args": {**self.tracer.fields, **self.args}})
+
+# Records spans in memory; fields (e.g. paper=...) are added to the args of every span
+class Tracer:
+    enabled = True
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.events = []
+
+    def span(self, name, **args): return Span(self, name, args)
+
+class _NullSpan:
+    def __enter__(self): return {}
+    def __exit__(self, *_): pass
+
+# Stand-in used when tracing is off: every span is the same do-nothing context manager
+# Callers check enabled before working out anything costly just to put it in a span
+class NullTracer:
+    enabled = False
+    fields = {}
+    events = ()
+    _span = _NullSpan()
+
+    def span(self, name, **args): return self._span
+
+null_tracer = NullTracer()
+
+def write_jsonl(events, path):
+    with open(path, "w") as f:
+        for event in events: f.write(json.dumps(event) + "\n")
+
+def write_chrome_trace(events, path):
+    with open(path, "w") as f: json.dump({"traceEvents": list(events), "displayTimeUnit": "ms"}, f)
+
+# JSON lines for .jsonl paths, a Chrome trace otherwise
+def write_trace(events, path):
+    (write_jsonl if path.lower().endswith(".jsonl") else write_chrome_trace)(events, path)
+
+# {span name: {"count", "seconds", "bytes"}} totals, slowest first, for a quick look without a trace viewer
+# Spans nest (a stage's span holds the spans of the stages it pulls from), so the seconds of different names overlap
+def summarize(events):
+    totals = {}
+    for event in events:
+        total = totals.setdefault(event["name"], {"count": 0, "seconds": 0.0, "bytes": 0})
+        total["count"] += 1
+        total["seconds"] += event["dur"] / 1e6
+        total["bytes"] += event["args"].get("bytes", 0)
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["seconds"]))
@@ -0,0 +1,211 @@
+import fitz
+import numpy as np
+from collections import OrderedDict
+from math import ceil, floor
+from PIL import Image
+from .trace import null_tracer
+
+# A colour is invisible on paper if it's missing or white
+def _visible(colour): return colour is not None and min(colour) < 0.99
+
+# MuPDF grows the bounds of text by one unit (a point here) to allow for its glyph cache's positioning
+text_padding = 1
+
+# Pixels of a page (on the splitter's 300dpi image grid) covered by visible vector content, as an L image: 0 for ink, 255 elsewhere
+# Text and images come from MuPDF's bbox log (text with its padding taken off, leaving the union of the glyph outlines),
+# paths from the drawing list, so white fills are skipped
+def vector_ink_mask(page, scale, width, height):
+    mask = np.full((height, width), 255, np.uint8)
+    boxes = []
+    for kind, (x0, y0, x1, y1) in page.get_bboxlog():
+        if kind in ("fill-text", "stroke-text"): boxes.append((x0+text_padding, y0+text_padding, x1-text_padding, y1-text_padding))
+        elif kind in ("fill-image", "fill-shade"): boxes.append((x0, y0, x1, y1))
+    for path in page.get_drawings():
+        stroked = "s" in path["type"] and _visible(path.get("color"))
+        filled = "f" in path["type"] and _visible(path.get("fill"))
+        if stroked or filled:
+            grow = (path.get("width") or 0)/2 if stroked else 0
+            rect = path["rect"]
+            boxes.append((rect.x0-grow, rect.y0-grow, rect.x1+grow, rect.y1+grow))
+    for x0, y0, x1, y1 in boxes:
+        # Hairlines still cover at least one pixel
+        top, left = max(0, floor(y0*scale)), max(0, floor(x0*scale))
+        mask[top:max(ceil(y1*scale), top+1), left:max(ceil(x1*scale), left+1)] = 0
+    return mask
+
+# (top, bottom) ranges of the rows of a page image (rendered at zoom pixels per point) that can hold ink, or None if unknown
+# Everything MuPDF paints is boxed (text and images from the bbox log, paths from the drawing list so pure white ones
+# can be left out) and grown by margin pixels, so rows outside the ranges are guaranteed white: scanning only them finds
+# exactly the ink a scan of the whole image would. Boxes lying entirely under one of the white tapes are left out,
+# and extra boxes (ink pasted onto the image afterwards) are added, both in pixels
+# Rotated pages and pages with annotations aren't worked out; None means the whole image has to be scanned
+def ink_row_ranges(page, zoom, height, tapes=(), extra=(), margin=3):
+    if page.rotation or page.first_annot or page.first_widget: return None
+    boxes = [rect for kind, rect in page.get_bboxlog() if kind.startswith(("fill-", "stroke-")) and not kind.endswith("-path")]
+    for path in page.get_drawings():
+        # Pattern fills come without a colour, so only pure white counts as nothing painted
+        stroked = "s" in path["type"] and path.get("color") != (1.0, 1.0, 1.0)
+        filled = "f" in path["type"] and path.get("fill") != (1.0, 1.0, 1.0)
+        if stroked or filled:
+            grow = (path.get("width") or 0)/2 if stroked else 0
+            rect = path["rect"]
+            boxes.append((rect.x0-grow, rect.y0-grow, rect.x1+grow, rect.y1+grow))
+    boxes = [(x0*zoom-margin, y0*zoom-margin, x1*zoom+margin, y1*zoom+margin) for x0, y0, x1, y1 in boxes]
+    boxes = [box for box in boxes if not any(t[0] <= box[0] and t[1] <= box[1] and box[2] <= t[2] and box[3] <= t[3] for t in tapes)]
+    ranges = []
+    for top, bottom in sorted((max(0, floor(box[1])), min(height, ceil(box[3]))) for box in boxes + list(extra)):
+        if top >= bottom: continue
+        if ranges and top <= ranges[-1][1]: ranges[-1][1] = max(ranges[-1][1], bottom)
+        else: ranges.append([top, bottom])
+    return [tuple(r) for r in ranges]
+
+# Box an operation draws on, in the coordinates of the image holding it
+def _dest_box(op):
+    if op[0] == "white": return op[1]
+    _, _, (sx0, sy0, sx1, sy1), (dx, dy) = op
+    return (dx, dy, dx+sx1-sx0, dy+sy1-sy0)
+
+def _overlaps(a, b): return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+# Stand-in for PageRasterCache when questions are exported as vector PDFs: pages are never rasterized,
+# their "images" are VectorImages that only record which part of which page goes where
+class VectorPages:
+    def __init__(self, source, page_width, cached_masks=4, tracer=null_tracer):
+        self.source = source
+        self.tracer = tracer
+        self.scale = 2480 / page_width # Same image grid as scaled_to_image
+        self._masks = OrderedDict()
+        self._cached_masks = cached_masks
+
+    def reserve(self, page_number, count=1): pass
+
+    def take(self, page_number, writable=False):
+        rect = self.source[page_number].rect
+        size = (round(rect.width*self.scale), round(rect.height*self.scale))
+        return VectorImage(self, size, [("page", page_number, (0, 0) + size, (0, 0))])
+
+    # Masks are already worked out from the page's coordinates, so there's nothing to narrow down
+    def ink_rows(self, page_number, image, tapes=(), pasted=()): return None
+
+    def blank(self, size): return VectorImage(self, size)
+
+    # Ink mask of a page, kept for the few most recently used pages (questions rarely span more than that)
+    def mask(self, page_number):
+        if page_number not in self._masks:
+            page = self.source[page_number]
+            with self.tracer.span("ink_mask", page=page_number):
+                self._masks[page_number] = vector_ink_mask(page, self.scale, round(page.rect.width*self.scale), round(page.rect.height*self.scale))
+            if len(self._masks) > self._cached_masks: self._masks.popitem(last=False)
+        self._masks.move_to_end(page_number)
+        return self._masks[page_number]
+
+# Drop-in for the PIL images the split stages work on, sized in 300dpi image pixels
+# Holds drawing operations instead of pixels, applied in order:
+#   ("page", page number, source box, destination top left) shows part of a source page
+#   ("white", box) covers whatever is under it
+# np.asarray() gives the ink of the result as a white background L image, so ink_bbox and InkProfile work unchanged
+class VectorImage:
+    mode = "PDF"
+
+    def __init__(self, pages, size, ops=None):
+        self.pages = pages
+        self.size = self.width, self.height = tuple(size)
+        self.ops = ops or []
+
+    def crop(self, box):
+        left, top, right, bottom = box
+        ops = []
+        for op in self.ops:
+            if op[0] == "white":
+                x0, y0, x1, y1 = op[1]
+                x0, y0, x1, y1 = max(x0, left), max(y0, top), min(x1, right), min(y1, bottom)
+                if x0 < x1 and y0 < y1: ops.append(("white", (x0-left, y0-top, x1-left, y1-top)))
+            else:
+                _, pageNumber, (sx0, sy0, sx1, sy1), (dx, dy) = op
+                x0, y0 = max(dx, left), max(dy, top)
+                x1, y1 = min(dx+sx1-sx0, right), min(dy+sy1-sy0, bottom)
+                if x0 < x1 and y0 < y1:
+                    ops.append(("page", pageNumber, (sx0+x0-dx, sy0+y0-dy, sx0+x1-dx, sy0+y1-dy), (x0-left, y0-top)))
+        return VectorImage(self.pages, (right-left, bottom-top), ops)
+
+    # Like PIL, box is a (left, top) corner or a (left, top, right, bottom) box, and the pasted image replaces what was there
+    def paste(self, im, box=None):
+        x, y = (box or (0, 0))[:2]
+        # Whiting out is only needed over something already drawn
+        if any(_overlaps(_dest_box(op), (x, y, x+im.width, y+im.height)) for op in self.ops):
+            self.ops.append(("white", (x, y, x+im.width, y+im.height)))
+        for op in im.ops:
+            if op[0] == "white":
+                x0, y0, x1, y1 = op[1]
+                self.ops.append(("white", (x0+x, y0+y, x1+x, y1+y)))
+            else:
+                self.ops.append(op[:3] + ((op[3][0]+x, op[3][1]+y),))
+
+    def __array__(self, dtype=None, copy=None):
+        pixels = np.full((self.height, self.width), 255, np.uint8)
+        for op in self.ops:
+            if op[0] == "white":
+                x0, y0, x1, y1 = op[1]
+                pixels[max(y0, 0):max(y1, 0), max(x0, 0):max(x1, 0)] = 255
+            else:
+                _, pageNumber, (sx0, sy0, sx1, sy1), (dx, dy) = op
+                source = self.pages.mask(pageNumber)[max(sy0, 0):sy1, max(sx0, 0):sx1]
+                dx, dy = dx + max(-sx0, 0), dy + max(-sy0, 0)
+                source = source[max(-dy, 0):, max(-dx, 0):]
+                target = pixels[max(dy, 0):max(dy, 0)+source.shape[0], max(dx, 0):max(dx, 0)+source.shape[1]]
+                target[...] = source[:target.shape[0], :target.shape[1]]
+        return pixels.astype(dtype) if dtype else pixels
+
+    def tobytes(self): return np.asarray(self).tobytes()
+
+    # One page PDF of the image, drawn from the source pages with clip rectangles (pixels -> points)
+    def to_pdf(self):
+        k = 1 / self.pages.scale
+        doc = fitz.open()
+        page = doc.new_page(width=self.width*k, height=self.height*k)
+        shape = None
+        for op in self.ops:
+            if op[0] == "white":
+                # Consecutive white rectangles go into one drawing
+                shape = shape or page.new_shape()
+                shape.draw_rect(fitz.Rect(op[1]) * k)
+                continue
+            if shape: shape.finish(color=None, fill=(1, 1, 1), width=0); shape.commit()
+            shape = None
+            _, pageNumber, (sx0, sy0, sx1, sy1), (dx, dy) = op
+            page.show_pdf_page(fitz.Rect(dx, dy, dx+sx1-sx0, dy+sy1-sy0) * k, self.pages.source, pageNumber,
+                               clip=fitz.Rect(sx0, sy0, sx1, sy1) * k)
+        if shape: shape.finish(color=None, fill=(1, 1, 1), width=0); shape.commit()
+        # show_pdf_page copies the source page's whole content, so text under the tapes (the printed question number,
+        # headers...) would still be there to search and copy: redact it away. Not where a later op draws over the white,
+        # like the either/or number pasted back below its label, which the redaction would take away too
+        # Text of a source page outside an op's clip is only clipped, not removed: extraction still finds the words cut
+        # through by the edges of a crop (e.g. beside the question number on an id strip)
+        redacted = False
+        for i, op in enumerate(self.ops):
+            if op[0] == "white" and not any(later[0] == "page" and _overlaps(_dest_box(later), op[1]) for later in self.ops[i+1:]):
+                page.add_redact_annot(fitz.Rect(op[1]) * k, fill=False, cross_out=False)
+                redacted = True
+        if redacted: page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE, graphics=fitz.PDF_REDACT_LINE_ART_NONE)
+        return doc
+
+    def save(self, fp, format=None):
+        self.to_pdf().save(fp, garbage=3, deflate=True)
+
+    # Same as PIL's reduce: an L image factor times smaller
+    # Rendered op by op from clips of the source pages, which is much cheaper than rendering the PDF to_pdf() builds
+    def reduce(self, factor):
+        zoom = self.pages.scale / factor
+        image = Image.new('L', (-(-self.width // factor), -(-self.height // factor)), 255)
+        for op in self.ops:
+            if op[0] == "white":
+                image.paste(255, tuple(round(v / factor) for v in op[1]))
+            else:
+                _, pageNumber, (sx0, sy0, sx1, sy1), (dx, dy) = op
+                pix = self.pages.source[pageNumber].get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY,
+                                                              clip=fitz.Rect(sx0, sy0, sx1, sy1) / self.pages.scale)
+                image.paste(Image.frombuffer('L', (pix.width, pix.height), pix.samples, 'raw', 'L', pix.stride, 1), (round(dx / factor), round(dy / factor)))
+        return image
+
+    # The rendered image at full (300dpi) size, for the steps that need real glyph shapes rather than ink boxes
+    def convert(self, mode): return self.reduce(1).convert(mode)
@@ -0,0 +1,63 @@
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from .trace import null_tracer
+from .options import png_colours
+
+_gray_palette = [round(level*255/15) for level in range(16) for _ in range(3)]
+_to_gray_level = [round(value*15/255) for value in range(256)]
+
+def to_png_colours(image, colours):
+    if colours == "L" or image.mode != "L": return image
+    if colours == "1": return image.convert("1", dither=Image.NONE)
+    palette = Image.frombuffer("P", image.size, image.point(_to_gray_level).tobytes(), "raw", "P", 0, 1)
+    palette.putpalette(_gray_palette)
+    return palette
+
+# Encodes and writes images on a small pool of threads while the split goes on (PIL releases the GIL while compressing)
+# At most max_pending images wait to be written, so a slow disk holds the split back instead of filling memory
+# Every file is written under a temporary name and renamed into place, so a reader never sees half an image
+# With threads=0 everything is written straight away on the calling thread, e.g. for vector PDFs, which read their
+# source document while saving and fitz documents can't be shared between threads
+class ImageWriter:
+    def __init__(self, threads=2, compress_level=6, colours="L", max_pending=None, tracer=null_tracer):
+        if colours not in png_colours: raise ValueError(f"Can't write {colours!r} PNGs, only {', '.join(png_colours)}")
+        self.compress_level = compress_level
+        self.colours = colours
+        self.tracer = tracer
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix="ImageWriter") if threads else None
+        self._slots = threading.Semaphore(max_pending or 2*threads or 1)
+        self._futures = []
+
+    def __enter__(self): return self
+    def __exit__(self, *_): self.shutdown()
+
+    # Queue image to be written to path; colours overrides the writer's colours for this image (e.g. "L" for thumbnails)
+    def write(self, image, path, colours=None):
+        if not self._pool: return self._write(image, path, colours)
+        self._slots.acquire()
+        future = self._pool.submit(self._write, image, path, colours)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _write(self, image, path, colours):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self.tracer.span("save", path=path) as span:
+            try:
+                if isinstance(image, Image.Image):
+                    to_png_colours(image, colours or self.colours).save(tmp, format="PNG", compress_level=self.compress_level)
+                else:
+                    image.save(tmp)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp): os.remove(tmp)
+                raise
+            if self.tracer.enabled: span.update(bytes=os.path.getsize(path), size=image.size)
+
+    # Wait for every queued image, raising the first error any of them hit
+    def flush(self):
+        futures, self._futures = self._futures, []
+        for future in futures: future.result()
+
+    def shutdown(self):
+        if self._pool: self._pool.shutdown(wait=True)
@@ -1,16 +1,30 @@
-import flet as ft, os
+import flet as ft, os, threading, time, base64
 from flet import Container, Column, Row, Text, Image, Stack, Icon
+from splitter.index import QuestionIndex, sessions
 
+_export_path = "./exports"
 _questions_path = "./exports/questions"
 _question_ids_path = "./exports/question_ids"
+_built_papers_path = "./exports/papers"
 
+# Questions loaded into the grid at a time; more are fetched from the index as the user scrolls down
+_grid_page_size = 60
+
+# What the screen shows when it opens is kept in a snapshot of the question index (see QuestionIndex.snapshot);
+# bump this when what goes in it changes
+_snapshot_version = 1
+
+# Index column each filter dropdown narrows by, left to right ("session_variant" filters on both columns)
+_filter_keys = ("curriculum", "syllabus", "year", "session_variant", "topic")
+
+# Grid tile showing a question's thumbnail; the full resolution image is only loaded by the zoom view
 class ImageBlock(Container):
-    def __init__(self, image_path, on_click=None):
+    def __init__(self, image_path, on_click=None, thumbnail_path=None, id_strip_path=None, on_zoom=None, copies=1):
         super().__init__(
             content=Stack(
                 controls=[
                     Image(
-                        src=image_path,
+                        src=thumbnail_path or image_path,
                         border_radius=10,
                         fit=ft.ImageFit.COVER,
                         height=float('inf'),
@@ -20,14 +34,18 @@ class ImageBlock(Container):
                         right=5,
                         bottom=5,
                         opacity=0,
-                        on_hover=self._hover_action
+                        on_hover=self._hover_action,
+                        on_click=lambda _: on_zoom(self) if on_zoom else None,
                     )
                 ],
             ),
             padding=5,
             # bgcolor=ft.colors.BLUE,
             on_click=on_click,
+            tooltip=f"Also in {copies-1} other paper{'s' if copies > 2 else ''}" if copies > 1 else None,
         )
+        self.image_path = image_path
+        self.id_strip_path = id_strip_path
     
     def _hover_action(self, e: ft.HoverEvent):
         if e.data == 'true':
@@ -38,6 +56,14 @@ class ImageBlock(Container):
 
     
 
+# Full size view of a question; vector PDF questions are rendered to a PNG on the fly, since flet can't show PDFs
+def _zoom_image(path, dpi=150):
+    if not path.lower().endswith(".pdf"): return Image(src=path)
+    import fitz # Only needed for vector questions, so not loaded on startup
+    with fitz.open(path) as doc:
+        png = doc[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY).tobytes("png")
+    return Image(src_base64=base64.b64encode(png).decode())
+
 class BuilderScreen(Row):
     def __init__(self, selected_items = []):
         super().__init__(
@@ -46,11 +72,12 @@ class BuilderScreen(Row):
                     controls=[
                         Row(
                             controls=[
-                                ft.Dropdown(label="Curriculum & Grade", expand=True),
-                                ft.Dropdown(label="Subject & Code", expand=True),
-                                ft.Dropdown(label="Year", expand=True),
-                                ft.Dropdown(label="Session & Variant", expand=True),
-                                ft.Dropdown(label="Topic", expand=True),
+                                ft.Dropdown(label="Curriculum & Grade", expand=True, on_change=self._filter_changed),
+                                ft.Dropdown(label="Subject & Code", expand=True, on_change=self._filter_changed),
+                                ft.Dropdown(label="Year", expand=True, on_change=self._filter_changed),
+                                ft.Dropdown(label="Session & Variant", expand=True, on_change=self._filter_changed),
+                                ft.Dropdown(label="Topic", expand=True, on_change=self._filter_changed),
+                                ft.Checkbox(label="Hide duplicates", value=True, on_change=self._refresh_list),
                             ],
                         ), # Filters
                         Row(
@@ -62,6 +89,8 @@ class BuilderScreen(Row):
                                         child_aspect_ratio=1,
                                         spacing=5,
                                         run_spacing=5,
+                                        on_scroll=self._grid_scrolled,
+                                        on_scroll_interval=100,
                                     ),
                                     expand=True,
                                     bgcolor=ft.colors.GREY_800,
@@ -74,6 +103,7 @@ class BuilderScreen(Row):
                         ),
                         Row(
                             controls=[
+                                ft.ProgressBar(value=0, expand=True, visible=False),
                                 Container(
                                     content=Text("Refresh"),
                                     bgcolor=ft.colors.BLUE_300,
@@ -86,6 +116,7 @@ class BuilderScreen(Row):
                                     bgcolor=ft.colors.BLUE_400,
                                     padding=ft.padding.symmetric(5, 15),
                                     border_radius=100,
+                                    on_click=self._build_paper,
                                 ),
                             ],
                             alignment=ft.MainAxisAlignment.END,
@@ -101,17 +132,92 @@ class BuilderScreen(Row):
 
         # self(Row)/controls[0](Column)/controls[1](Row)/controls[0](Container)/content(GridView)/controls
         self.image_list = self.controls[0].controls[1].controls[0].content.controls
+        # self(Row)/controls[0](Column)/controls[0](Row)/controls
+        self.filter_dropdowns = self.controls[0].controls[0].controls[:len(_filter_keys)]
+        # Questions found in several papers are shown once while this is ticked
+        self.hide_duplicates = self.controls[0].controls[0].controls[len(_filter_keys)]
+        # self(Row)/controls[0](Column)/controls[2](Row)/controls[0](ProgressBar)
+        self.build_progress = self.controls[0].controls[2].controls[0]
         self.selected_items = selected_items
-        self._add_questions_to_grid()
+        # flet runs handlers on a thread pool: two scroll events mustn't load the same page of questions twice,
+        # nor a filter change clear the grid while it's being filled
+        self._grid_lock = threading.RLock()
+        self.index = QuestionIndex(_export_path)
+        self._open()
+
+    # Fill the dropdowns and the first questions of the grid, from the index's snapshot if nothing changed since it was taken
+    def _open(self):
+        snapshot = self.index.snapshot("builder")
+        if not snapshot or snapshot.get("version") != _snapshot_version:
+            generation = self.index.generation
+            snapshot = {"version": _snapshot_version,
+                        "options": [self._filter_options(position) for position in range(len(_filter_keys))],
+                        # Two pages up front, so the grid is tall enough to scroll even on big screens
+                        "rows": [dict(row) for row in self._find(2*_grid_page_size)]}
+            self.index.save_snapshot("builder", generation, snapshot)
+        for dropdown, options in zip(self.filter_dropdowns, snapshot["options"]): self._set_options(dropdown, options)
+        self._add_questions_to_grid(rows=snapshot["rows"])
+
+    # Index filters for the current dropdown selections, up to (not including) dropdown `upto`
+    def _filters(self, upto=len(_filter_keys)):
+        filters = {}
+        for key, dropdown in zip(_filter_keys[:upto], self.filter_dropdowns):
+            if not dropdown.value: continue
+            if key == "session_variant":
+                filters["session"], variant = dropdown.value.split()
+                filters["variant"] = int(variant)
+            else:
+                filters[key] = int(dropdown.value) if key == "year" else dropdown.value
+        return filters
+
+    # (key, text) options of dropdown `position`, narrowed by the selections to its left
+    def _filter_options(self, position):
+        key, filters = _filter_keys[position], self._filters(position)
+        if key == "session_variant":
+            return [(f"{session} {variant}", f"{sessions.get(session, session)} (variant {variant})") for session, variant in self.index.distinct("session", "variant", **filters)]
+        return [(str(value), str(value)) for value in self.index.distinct(key, **filters)]
+
+    def _set_options(self, dropdown, options):
+        dropdown.options = [ft.dropdown.Option(key="", text="All")] + [ft.dropdown.Option(key=k, text=text) for k, text in options]
+
+    # Refill the options of every dropdown from `start` on, each narrowed by the selections to its left
+    def _fill_filter_options(self, start):
+        for position in range(start, len(_filter_keys)):
+            self._set_options(self.filter_dropdowns[position], self._filter_options(position))
+            if position > start: self.filter_dropdowns[position].value = None
+
+    def _filter_changed(self, e: ft.ControlEvent):
+        with self._grid_lock:
+            self._fill_filter_options(self.filter_dropdowns.index(e.control) + 1)
+            self._refresh_list(e)
     
-    def _add_questions_to_grid(self):
-        for filename in os.listdir(_questions_path):
-            img_path = os.path.join(_questions_path, filename)
-            if os.path.isfile(img_path):
+    def _find(self, count):
+        return self.index.find(limit=count, offset=len(self.image_list), collapse_duplicates=self.hide_duplicates.value, **self._filters())
+
+    # Append the next `count` matching questions (or the given rows) to the grid, returning how many there were
+    def _add_questions_to_grid(self, count=_grid_page_size, rows=None):
+        with self._grid_lock:
+            if rows is None: rows = self._find(count)
+            for row in rows:
                 self.image_list.append(ImageBlock(
-                    image_path=img_path,
+                    image_path=os.path.join(_export_path, row["image_path"]),
+                    thumbnail_path=os.path.join(_export_path, row["thumbnail_path"]) if row["thumbnail_path"] else None,
+                    id_strip_path=os.path.join(_export_path, row["id_strip_path"]),
                     on_click=self._toggle_selection,
+                    on_zoom=self._zoom_question,
+                    copies=row["copies"] if self.hide_duplicates.value else 1,
                 ))
+            return len(rows)
+
+    # Load the next page of questions once the user scrolls within a screen of the end of the grid
+    def _grid_scrolled(self, e: ft.OnScrollEvent):
+        if e.pixels >= e.max_scroll_extent - e.viewport_dimension and self._add_questions_to_grid():
+            self.update()
+
+    def _zoom_question(self, block: ImageBlock):
+        self.page.show_dialog(ft.AlertDialog(
+            content=Column(controls=[_zoom_image(block.image_path)], scroll=ft.ScrollMode.AUTO),
+        ))
     
     def _toggle_selection(self, e: ft.TapEvent):
         if e.control not in self.selected_items:
@@ -138,10 +244,32 @@ class BuilderScreen(Row):
             self.update()
     
     def _refresh_list(self, e: ft.TapEvent):
-        self.image_list.clear()
-        self.selected_items.clear()
-        self._add_questions_to_grid()
+        with self._grid_lock:
+            self.image_list.clear()
+            self.selected_items.clear()
+            self._add_questions_to_grid(2*_grid_page_size)
         self.update()
-    
 
+    # Build the selected questions into a PDF on a worker thread, so the UI stays responsive while it runs
+    def _build_paper(self, e: ft.TapEvent):
+        if not self.selected_items or self.build_progress.visible: return
+        questions = [(item.image_path, item.id_strip_path) for item in self.selected_items]
+        output_path = os.path.join(_built_papers_path, time.strftime("paper_%Y%m%d_%H%M%S.pdf"))
+        self.build_progress.value, self.build_progress.visible = 0, True
+        self.update()
+        threading.Thread(target=self._run_build, args=(questions, output_path), daemon=True).start()
+
+    def _run_build(self, questions, output_path):
+        from builder import build_paper # PyMuPDF is only loaded once a paper is built
+        try:
+            pages = build_paper(questions, output_path, on_progress=self._build_progressed)
+            message = f"Built {len(questions)} questions on {pages} pages: {output_path}"
+        except Exception as error:
+            message = f"Couldn't build the paper: {error}"
+        self.build_progress.visible = False
+        self.update()
+        self.page.show_snack_bar(ft.SnackBar(Text(message)))
 
+    def _build_progressed(self, done, total):
+        self.build_progress.value = done / total
+        self.build_progress.update()
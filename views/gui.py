@@ -1,6 +1,9 @@
-import flet as ft
+import flet as ft, os, sys
 from flet import Page, Container, Column, Row, Text, Image
-from builder_screen import BuilderScreen
+# The screens read the splitter's question index, so the repository root has to be importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from views.builder_screen import BuilderScreen
+from views.splitter_screen import SplitterScreen
 
 class TabButton(Container):
     def __init__(self, tab_text):
@@ -11,6 +14,8 @@ class TabButton(Container):
             border_radius=5,
         )
 
+# screen_list holds what builds each tab's screen (a screen class or any callable): a screen is only built
+# the first time its tab is opened, then kept in self.screens
 class TabsRow(Row):
     def __init__(self, active_tab_index=0, screen_list: list = [], page: Page = None):
         super().__init__(
@@ -21,6 +26,7 @@ class TabsRow(Row):
         )
         self.active_tab_index = active_tab_index
         self.screen_list = screen_list
+        self.screens = [None] * len(screen_list)
         self.page = page
         
         for tab in self.controls: tab.on_click = self.activate_tab
@@ -33,56 +39,28 @@ class TabsRow(Row):
 
             e.control.bgcolor = ft.colors.BLUE
             self.active_tab_index = self.controls.index(e.control)
-            self.page.controls.append(self.screen_list[self.active_tab_index])
+            self.page.controls.append(self.screen(self.active_tab_index))
             self.page.update()
 
+    def screen(self, index):
+        if self.screens[index] is None: self.screens[index] = self.screen_list[index]()
+        return self.screens[index]
+
     def deactivate_tab(self):
         self.controls[self.active_tab_index].bgcolor = ft.colors.GREY
         self.page.controls.pop()
         self.update()
 
 
-class SplitterScreen(Row):
-    def __init__(self):
-        super().__init__(
-            controls=[
-                Column(
-                    controls=[
-                        ft.SearchBar(), # Filters
-                        Row(
-                            controls=[
-                                ft.GridView()
-                            ],
-                            expand=True,
-                            vertical_alignment=ft.CrossAxisAlignment.STRETCH,
-                        ), # Gallery
-                        Row(
-                            controls=[
-                                Container(
-                                    content=Text("Split Paper"),
-                                    bgcolor=ft.colors.BLUE_400,
-                                    padding=ft.padding.symmetric(5, 15),
-                                    border_radius=100,
-                                ),
-                            ],
-                            alignment=ft.MainAxisAlignment.END,
-                        )
-                    ],
-                    horizontal_alignment=ft.CrossAxisAlignment.STRETCH,
-                    expand=True,
-                )
-            ],
-            vertical_alignment=ft.CrossAxisAlignment.STRETCH,
-            expand=True,
-        )
-
 def main(page: Page):
     page.bgcolor = ft.colors.GREY_900
     active_screen = 0
-    screen_list = [BuilderScreen(), SplitterScreen()]
+    tabs = TabsRow(active_screen, [BuilderScreen, SplitterScreen], page)
+    # Stop any split jobs still running when the window closes
+    page.on_disconnect = lambda _: tabs.screens[1] and tabs.screens[1].close()
     page.add(
-        TabsRow(active_screen, screen_list, page),
-        screen_list[active_screen],
+        tabs,
+        tabs.screen(active_screen),
     )
 
 if __name__ == "__main__":
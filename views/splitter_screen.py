@@ -0,0 +1,155 @@
+import flet as ft, os
+from flet import Container, Column, Row, Text
+from views.builder_screen import ImageBlock, _zoom_image
+
+_export_path = "./exports"
+
+# Update a control from the job queue's thread, unless its tab isn't showing (it's redrawn when it comes back)
+def _refresh(control):
+    if control.page: control.update()
+
+# One queued paper: its name, how far the split got and a button to cancel it
+class JobRow(Container):
+    def __init__(self, job, on_cancel):
+        super().__init__(
+            content=Column(
+                controls=[
+                    Row(
+                        controls=[
+                            Text(job.name, expand=True, no_wrap=True),
+                            ft.IconButton(ft.icons.CLOSE, icon_size=16, tooltip="Cancel", on_click=lambda _: on_cancel(job)),
+                        ],
+                    ),
+                    ft.ProgressBar(value=0),
+                    Text("Queued", size=12, color=ft.colors.GREY_400),
+                ],
+                spacing=2,
+            ),
+            bgcolor=ft.colors.GREY_800,
+            border_radius=10,
+            padding=ft.padding.symmetric(5, 10),
+        )
+        # self(Container)/content(Column)/controls[0](Row)/controls[1](IconButton)
+        self.cancel_button = self.content.controls[0].controls[1]
+        self.progress_bar, self.status_text = self.content.controls[1], self.content.controls[2]
+
+    def show(self, job, kind):
+        self.progress_bar.value = job.progress
+        if kind == "progress": self.status_text.value = f"{job.stage} (page {job.pages_done} of {job.pages}), {len(job.questions)} questions"
+        elif kind == "question": self.status_text.value = f"{len(job.questions)} questions"
+        elif kind == "failed": self.status_text.value = "Failed: " + job.result.error.strip().splitlines()[-1]
+        elif kind == "done": self.status_text.value = f"Done: {job.result.questions} questions in {job.result.seconds:.1f}s"
+        else: self.status_text.value = {"started": "Splitting", "skipped": "Already split", "cancelled": "Cancelled"}.get(kind, self.status_text.value)
+        self.cancel_button.visible = job.status in ("queued", "running")
+        _refresh(self)
+
+# Papers picked here are split in the background (see splitter.jobs): the list on the left follows every job,
+# the gallery fills with questions as they are saved
+class SplitterScreen(Row):
+    def __init__(self, workers=None):
+        super().__init__(
+            controls=[
+                Column(
+                    controls=[
+                        ft.SearchBar(), # Filters
+                        Row(
+                            controls=[
+                                Container(
+                                    content=ft.ListView(spacing=5),
+                                    width=320,
+                                ), # Jobs
+                                Container(
+                                    content=ft.GridView(
+                                        max_extent=200,
+                                        child_aspect_ratio=1,
+                                        spacing=5,
+                                        run_spacing=5,
+                                    ),
+                                    expand=True,
+                                    bgcolor=ft.colors.GREY_800,
+                                    border_radius=10,
+                                    padding=10,
+                                ), # Gallery
+                            ],
+                            expand=True,
+                            vertical_alignment=ft.CrossAxisAlignment.STRETCH,
+                        ),
+                        Row(
+                            controls=[
+                                Container(
+                                    content=Text("Cancel All"),
+                                    bgcolor=ft.colors.GREY_600,
+                                    padding=ft.padding.symmetric(5, 15),
+                                    border_radius=100,
+                                    on_click=lambda _: self.queue and self.queue.cancel_all(),
+                                ),
+                                Container(
+                                    content=Text("Split Paper"),
+                                    bgcolor=ft.colors.BLUE_400,
+                                    padding=ft.padding.symmetric(5, 15),
+                                    border_radius=100,
+                                    on_click=self._pick_papers,
+                                ),
+                            ],
+                            alignment=ft.MainAxisAlignment.END,
+                        )
+                    ],
+                    horizontal_alignment=ft.CrossAxisAlignment.STRETCH,
+                    expand=True,
+                )
+            ],
+            vertical_alignment=ft.CrossAxisAlignment.STRETCH,
+            expand=True,
+        )
+
+        # self(Row)/controls[0](Column)/controls[1](Row)/controls[0](Container)/content(ListView)
+        self.job_list = self.controls[0].controls[1].controls[0].content
+        # self(Row)/controls[0](Column)/controls[1](Row)/controls[1](Container)/content(GridView)
+        self.gallery = self.controls[0].controls[1].controls[1].content
+        self.file_picker = ft.FilePicker(on_result=self._papers_picked)
+        self.workers = workers
+        # Started with the first job, so opening the app doesn't spawn worker processes
+        self.queue = None
+        self.job_rows = {}
+
+    def did_mount(self):
+        if self.file_picker not in self.page.overlay:
+            self.page.overlay.append(self.file_picker)
+            self.page.update()
+
+    def _pick_papers(self, e: ft.TapEvent):
+        self.file_picker.pick_files("Papers to split", allowed_extensions=["pdf"], allow_multiple=True)
+
+    def _papers_picked(self, e: ft.FilePickerResultEvent):
+        if not e.files: return
+        if self.queue is None:
+            # The splitter (and PyMuPDF, numpy...) is only imported once there's something to split
+            from splitter.jobs import SplitJobQueue
+            self.queue = SplitJobQueue(self.workers, _export_path, on_event=self._job_event)
+        for file in e.files: self.queue.submit(file.path)
+
+    def _zoom_question(self, block: ImageBlock):
+        self.page.show_dialog(ft.AlertDialog(
+            content=Column(controls=[_zoom_image(block.image_path)], scroll=ft.ScrollMode.AUTO),
+        ))
+
+    # Called on the job queue's thread for every event of every job
+    def _job_event(self, job, kind, data):
+        if kind == "queued":
+            self.job_rows[job.id] = JobRow(job, lambda job: self.queue.cancel(job.id))
+            self.job_list.controls.append(self.job_rows[job.id])
+            _refresh(self.job_list)
+            return
+        if kind == "question":
+            self.gallery.controls.append(ImageBlock(
+                image_path=os.path.join(_export_path, data["image_path"]),
+                thumbnail_path=os.path.join(_export_path, data["thumbnail_path"]),
+                id_strip_path=os.path.join(_export_path, data["id_strip_path"]),
+                on_zoom=self._zoom_question,
+            ))
+            _refresh(self.gallery)
+        self.job_rows[job.id].show(job, kind)
+
+    # Cancel every job and stop the worker processes
+    def close(self):
+        if self.queue: self.queue.close()